@@ -0,0 +1,348 @@
+"""Measures ingest throughput by feeding the image cog simulated discord
+messages, against a local MongoDB and without connecting to discord.
+
+    cd app
+    python3 -m benchmarks.ingest --messages 200 --latency 50
+"""
+import io
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from cogs.image import ImageCog
+from common.config import config
+from common.database import Mongo
+from common.ingest import ingest_seconds, transcode_seconds
+from common.models import ChannelModel
+
+CHANNEL_ID = 800000000000000000
+BOT_ID = 600000000000000000
+
+# (width, height, format) of the generated fixtures
+FIXTURES = [
+    (640, 480, "PNG"),
+    (1280, 720, "JPEG"),
+    (1920, 1080, "PNG"),
+    (1920, 1080, "JPEG"),
+    (4032, 3024, "JPEG"),
+    (5120, 2880, "PNG"),
+]
+
+
+def make_fixtures() -> List[bytes]:
+    """Noisy gradients in each size and format, noise keeps png and jpeg
+    from compressing unrealistically well
+    """
+    fixtures = []
+    for width, height, fmt in FIXTURES:
+        gradient = Image.linear_gradient("L").resize((width, height))
+        noise = Image.effect_noise((width, height), 40)
+        im = Image.merge("RGB", (gradient, noise, gradient.rotate(180)))
+        buffer = io.BytesIO()
+        im.save(buffer, fmt)
+        fixtures.append(buffer.getvalue())
+    return fixtures
+
+
+class Rest:
+    """Stands in for discord's REST api, every call takes latency"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+
+    async def call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        await asyncio.sleep(self.latency)
+
+
+class FakeContent:
+    def __init__(self, data: bytes, latency: float):
+        self.data = data
+        self.latency = latency
+
+    async def iter_chunked(self, size: int):
+        await asyncio.sleep(self.latency)
+        for i in range(0, len(self.data), size):
+            yield self.data[i : i + size]
+
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, data: bytes, latency: float):
+        self.content = FakeContent(data, latency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    """Serves attachment urls from the fixtures instead of discord's cdn.
+    Each url is a fixture with unique trailing bytes, so identical
+    fixtures aren't deduped, decoders ignore data after the image
+    """
+
+    def __init__(self, fixtures: List[bytes], latency: float):
+        self.fixtures = fixtures
+        self.files: Dict[str, Tuple[int, bytes]] = {}
+        self.latency = latency
+
+    def add(self, url: str) -> int:
+        """Picks a fixture for url, returns its size"""
+        fixture = random.randrange(len(self.fixtures))
+        self.files[url] = (fixture, os.urandom(16))
+        return len(self.fixtures[fixture]) + 16
+
+    def get(self, url: str) -> FakeResponse:
+        fixture, suffix = self.files[url]
+        return FakeResponse(self.fixtures[fixture] + suffix, self.latency)
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeAttachment:
+    def __init__(self, attachment_id: int, filename: str, size: int):
+        self.id = attachment_id
+        self.filename = filename
+        self.size = size
+        self.url = f"https://cdn.invalid/{attachment_id}/{filename}"
+
+
+class FakeUser:
+    id = 500000000000000000
+    name = "bench"
+    discriminator = "0001"
+
+
+class FakeChannel:
+    def __init__(self, rest: Rest):
+        self.id = CHANNEL_ID
+        self.rest = rest
+
+    async def send(self, *args, **kwargs) -> None:
+        await self.rest.call("send")
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        message_id: int,
+        channel: FakeChannel,
+        attachments: List[FakeAttachment],
+    ):
+        self.id = message_id
+        self.channel = channel
+        self.author = FakeUser()
+        self.attachments = attachments
+        self.created_at = datetime.utcnow()
+
+    async def add_reaction(self, emoji: str) -> None:
+        await self.channel.rest.call("add_reaction")
+
+    async def remove_reaction(self, emoji: str, member) -> None:
+        await self.channel.rest.call("remove_reaction")
+
+    async def reply(self, *args, **kwargs) -> None:
+        await self.channel.rest.call("reply")
+
+
+class FakeBotUser:
+    id = BOT_ID
+
+
+class FakeBot:
+    """Just enough of commands.Bot for the image cog"""
+
+    def __init__(self, channel: FakeChannel):
+        self.user = FakeBotUser()
+        self.channel = channel
+        self.cached_messages: List[FakeMessage] = []
+
+    async def wait_until_ready(self) -> None:
+        pass
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channel if channel_id == self.channel.id else None
+
+
+def rss_kb() -> int:
+    """Resident memory of this process and its children, eg. the
+    transcoder workers, from /proc
+    """
+    total = 0
+    pids = [os.getpid()]
+    for task in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{task}/children") as f:
+                pids += [int(pid) for pid in f.read().split()]
+        except FileNotFoundError:
+            pass
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except FileNotFoundError:
+            pass
+    return total
+
+
+async def monitor(lags: List[float], peak: List[int]) -> None:
+    """Records how late the event loop wakes up from short sleeps
+    and the peak memory use
+    """
+    interval = 0.01
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+        if len(lags) % 10 == 0:
+            peak[0] = max(peak[0], rss_kb())
+
+
+def stage_times() -> Dict[str, float]:
+    """Average seconds per stage from the ingest metrics"""
+    times = {}
+    for (stage,), (counts, total) in ingest_seconds.values.items():
+        times[stage] = total / max(1, sum(counts))
+    for _, (counts, total) in transcode_seconds.values.items():
+        times["transcode per megapixel"] = total / max(1, sum(counts))
+    return times
+
+
+async def run(
+    uri: str,
+    database: str,
+    messages: int,
+    attachments: int,
+    latency: float,
+    output: Optional[str],
+) -> None:
+    config["database"]["uri"] = uri
+    config["database"]["database"] = database
+    uploads = tempfile.TemporaryDirectory()
+    config["directories"]["uploadsdir"] = uploads.name
+    Mongo.connect()
+    db = Mongo.motor[database]
+    for collection in ("image", "channel", "counter", "ingest_queue"):
+        await db[collection].drop()
+    await Mongo.db.save(
+        ChannelModel(
+            channel_id=str(CHANNEL_ID),
+            channel_name="bench",
+            alias="bench",
+            guild="bench",
+            guild_id="700000000000000000",
+        )
+    )
+    fixtures = make_fixtures()
+    rest = Rest(latency)
+    channel = FakeChannel(rest)
+    bot = FakeBot(channel)
+    cog = ImageCog(bot)
+    await cog.session.close()
+    session = FakeSession(fixtures, latency)
+    cog.session = session
+    while not cog.ingest_queue.tasks:
+        await asyncio.sleep(0.01)
+
+    lags: List[float] = []
+    peak = [rss_kb()]
+    watcher = asyncio.ensure_future(monitor(lags, peak))
+    start = time.perf_counter()
+    for i in range(messages):
+        message_attachments = []
+        for j in range(attachments):
+            attachment_id = 900000000000000000 + i * attachments + j
+            attachment = FakeAttachment(
+                attachment_id, f"{attachment_id}.png", 0
+            )
+            attachment.size = session.add(attachment.url)
+            message_attachments.append(attachment)
+        message = FakeMessage(
+            100000000000000000 + i, channel, message_attachments
+        )
+        bot.cached_messages.append(message)
+        await cog.on_message(message)
+    # finished jobs are removed from the queue, failed ones are kept
+    while await db.ingest_queue.count_documents({"failed": False}):
+        await asyncio.sleep(0.25)
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    cog.cog_unload()
+
+    images = messages * attachments
+    lags.sort()
+    result = {
+        "date": datetime.utcnow().isoformat(),
+        "messages": messages,
+        "attachments": attachments,
+        "latency": latency,
+        "workers": config["transcoder"]["workers"],
+        "concurrency": config["ingest"]["concurrency"],
+        "seconds": elapsed,
+        "images_per_second": images / elapsed,
+        "loop_lag_ms": {
+            "p50": statistics.median(lags),
+            "p99": lags[int(len(lags) * 0.99)],
+            "max": lags[-1],
+        },
+        "peak_rss_mb": peak[0] / 1024,
+        "peak_rss_main_mb": resource.getrusage(
+            resource.RUSAGE_SELF
+        ).ru_maxrss
+        / 1024,
+        "stage_seconds": stage_times(),
+        "rest_calls": rest.calls,
+    }
+    print(json.dumps(result, indent=2))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+    Mongo.close()
+    uploads.cleanup()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--uri", default="mongodb://127.0.0.1:27017")
+    parser.add_argument("--database", default="discord2vrc_bench")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--attachments", type=int, default=2)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=50,
+        help="ms added to every simulated discord call and download",
+    )
+    parser.add_argument("--output", help="file to save results to as JSON")
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        run(
+            args.uri,
+            args.database,
+            args.messages,
+            args.attachments,
+            args.latency / 1000,
+            args.output,
+        )
+    )
@@ -0,0 +1,109 @@
+"""Compares the /api/randomimage aggregation that joins channels before
+sampling against the current one that samples first.
+
+    cd app
+    python3 -m benchmarks.randomimage --uri mongodb://127.0.0.1:27017
+"""
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from migrate import migrate
+from benchmarks.seed import seed
+from routes.api import random_images_pipeline
+
+
+def lookup_first_pipeline(match: dict, limit: int) -> List[dict]:
+    """The aggregation /api/randomimage used before sampling first"""
+    pipeline = [
+        {
+            "$lookup": {
+                "from": "channel",
+                "localField": "channel",
+                "foreignField": "_id",
+                "as": "channel",
+            }
+        },
+        {"$unwind": {"path": "$channel"}},
+        {"$sample": {"size": limit}},
+    ]
+    if match:
+        pipeline.insert(0, {"$match": match})
+    return pipeline
+
+
+async def time_pipeline(
+    db: AsyncIOMotorDatabase, pipeline: List[dict], runs: int
+) -> Dict[str, float]:
+    """Runs an aggregation runs times, returns latencies in ms"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await db.image.aggregate(pipeline).to_list(length=None)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "max": timings[-1],
+    }
+
+
+async def run(
+    uri: str,
+    database: str,
+    sizes: List[int],
+    runs: int,
+    output: Optional[str],
+) -> None:
+    db = AsyncIOMotorClient(uri)[database]
+    results: Dict[str, dict] = {}
+    print(f"{'images':>9} {'filter':<16} {'pipeline':<14} {'p50 ms':>9}")
+    for size in sizes:
+        channels = await seed(db, size)
+        await migrate(db)
+        filters = {
+            "none": {},
+            "deleted": {"deleted": False},
+            "channel+deleted": {
+                "channel": channels[0]["_id"],
+                "deleted": False,
+            },
+        }
+        size_results = results.setdefault(str(size), {})
+        for name, match in filters.items():
+            for label, build in (
+                ("lookup first", lookup_first_pipeline),
+                ("sample first", random_images_pipeline),
+            ):
+                result = await time_pipeline(db, build(match, 100), runs)
+                size_results.setdefault(name, {})[label] = result
+                print(
+                    f"{size:>9} {name:<16} {label:<14} {result['p50']:>9.1f}"
+                )
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--uri", default="mongodb://127.0.0.1:27017")
+    parser.add_argument("--database", default="discord2vrc_bench")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="file to save results to as JSON")
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        run(args.uri, args.database, args.sizes, args.runs, args.output)
+    )
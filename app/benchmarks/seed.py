@@ -0,0 +1,92 @@
+import random
+
+from datetime import datetime, timedelta
+from typing import List
+
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+# discord snowflakes are milliseconds since 2015 shifted left 22 bits
+DISCORD_EPOCH = 1420070400000
+
+
+def snowflake(when: datetime, sequence: int) -> str:
+    """Builds a discord style id for a point in time"""
+    ms = int(when.timestamp() * 1000) - DISCORD_EPOCH
+    return str((ms << 22) | (sequence & 0x3FFFFF))
+
+
+def channel_docs(channels: int) -> List[dict]:
+    """Synthetic ChannelModel documents"""
+    return [
+        {
+            "_id": ObjectId(),
+            "channel_id": str(800000000000000000 + i),
+            "channel_name": f"channel-{i}",
+            "alias": f"bench{i}",
+            "guild": "bench",
+            "guild_id": "700000000000000000",
+            "subscribed": True,
+        }
+        for i in range(channels)
+    ]
+
+
+def image_doc(
+    i: int, when: datetime, channel: dict, deleted_ratio: float
+) -> dict:
+    """Synthetic ImageModel document"""
+    attachment_id = snowflake(when, i)
+    return {
+        "filename": f"{attachment_id}.png",
+        "filepath": f"uploads/{attachment_id}.jpg",
+        "attachment_id": attachment_id,
+        "channel": channel["_id"],
+        "username": "bench",
+        "user_num": "0001",
+        "user_id": "600000000000000000",
+        "message_id": snowflake(when, i + 1),
+        "created_at": when,
+        "retrieved_at": when,
+        "updated_at": when,
+        "deleted": random.random() < deleted_ratio,
+        "width": 1920,
+        "height": 1080,
+        "sizes": [512, 1024],
+        "filesize": 250000,
+    }
+
+
+async def seed(
+    db: AsyncIOMotorDatabase,
+    images: int,
+    channels: int = 10,
+    deleted_ratio: float = 0.05,
+    batch: int = 10000,
+) -> List[dict]:
+    """Replaces the image and channel collections of db with synthetic
+    data, unless they already hold the same number of images.
+    Applied migrations are forgotten so indexes can be set up again.
+    Returns the channel documents
+    """
+    if await db.image.estimated_document_count() == images:
+        existing = await db.channel.find().to_list(length=None)
+        if len(existing) == channels:
+            return existing
+    await db.image.drop()
+    await db.channel.drop()
+    await db.migration.drop()
+    docs = channel_docs(channels)
+    await db.channel.insert_many(docs)
+    start = datetime(2020, 1, 1)
+    pending = []
+    for i in range(images):
+        when = start + timedelta(seconds=i * 30)
+        channel = docs[i % channels]
+        pending.append(image_doc(i, when, channel, deleted_ratio))
+        if len(pending) >= batch:
+            await db.image.insert_many(pending, ordered=False)
+            pending = []
+    if pending:
+        await db.image.insert_many(pending, ordered=False)
+    return docs
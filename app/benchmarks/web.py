@@ -0,0 +1,259 @@
+"""Load tests the /vrc and /api routes through the ASGI app against a
+local MongoDB seeded with synthetic images, saving latencies as JSON.
+
+    cd app
+    python3 -m benchmarks.web --uri mongodb://127.0.0.1:27017 \\
+        --output results.json --compare baseline.json
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import statistics
+
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from web import app
+from common.config import config
+from common.counters import reconcile
+from common.utils import channel_cache
+from benchmarks.seed import seed
+from migrate import migrate
+from routes.vrc import randomsync_cache
+
+Route = Callable[[], str]
+
+
+def routes(aliases: List[str], attachment_ids: List[str]) -> Dict[str, Route]:
+    """Paths to request for each route, randomised per request"""
+
+    def alias() -> str:
+        return random.choice(aliases)
+
+    def index() -> int:
+        return random.randint(0, 500)
+
+    return {
+        "vrc all ordered": lambda: f"/vrc/all/image/{index()}",
+        "vrc all random": lambda: "/vrc/all/random",
+        "vrc all randomsync": lambda: (
+            f"/vrc/all/randomsync?offset={random.randint(0, 50)}"
+        ),
+        "vrc channel ordered": lambda: (
+            f"/vrc/channel/{alias()}/image/{index()}?order=asc"
+        ),
+        "vrc channel random": lambda: f"/vrc/channel/{alias()}/random",
+        "vrc channel randomsync": lambda: (
+            f"/vrc/channel/{alias()}/randomsync"
+            f"?offset={random.randint(0, 50)}"
+        ),
+        "api image": lambda: "/api/image?limit=100",
+        "api image channel": lambda: f"/api/image?alias={alias()}&limit=100",
+        "api randomimage": lambda: "/api/randomimage?limit=10",
+        "api image by id": lambda: (
+            f"/api/image/{random.choice(attachment_ids)}"
+        ),
+        "api channel": lambda: "/api/channel",
+        "api channel by alias": lambda: f"/api/channel/{alias()}",
+        "api count": lambda: "/api/count/image?deleted=false",
+        "api count channel": lambda: (
+            f"/api/count/image?alias={alias()}&deleted=false"
+        ),
+    }
+
+
+async def request(app, target: str) -> int:
+    """Sends a GET straight to the ASGI app, returns the status code"""
+    path, _, query = target.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    status = 0
+    sent = False
+    done = asyncio.Event()
+
+    async def receive() -> dict:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif not message.get("more_body", False):
+            done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status
+
+
+async def load(
+    app, route: Route, requests: int, concurrency: int
+) -> Dict[str, float]:
+    """Sends requests from concurrency clients at once,
+    returns latency percentiles in ms and requests per second
+    """
+    timings: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def client() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            status = await request(app, route())
+            timings.append((time.perf_counter() - start) * 1000)
+            if status >= 500:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    percentiles = statistics.quantiles(timings, n=100)
+    return {
+        "p50": percentiles[49],
+        "p95": percentiles[94],
+        "p99": percentiles[98],
+        "rps": len(timings) / elapsed,
+        "errors": errors,
+    }
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """Prints changes in p50 and p95 against a previous run"""
+    print(
+        f"\n{'images':>9} {'route':<24} {'p50 change':>11} "
+        f"{'p95 change':>11}"
+    )
+    for size, size_results in results["results"].items():
+        previous = baseline["results"].get(size, {})
+        for name, result in size_results.items():
+            if name not in previous or "p50" not in result:
+                continue
+            changes = [
+                f"{(result[q] / previous[name][q] - 1) * 100:>+10.1f}%"
+                if previous[name][q]
+                else f"{'n/a':>11}"
+                for q in ("p50", "p95")
+            ]
+            print(f"{size:>9} {name:<24} {changes[0]} {changes[1]}")
+
+
+async def run(
+    uri: str,
+    database: str,
+    sizes: List[int],
+    requests: int,
+    concurrency: int,
+    output: str,
+    baseline: Optional[str],
+) -> None:
+    db = AsyncIOMotorClient(uri)[database]
+    # Mongo.connect reads these when the app starts up
+    config["database"]["uri"] = uri
+    config["database"]["database"] = database
+    results: dict = {
+        "meta": {
+            "date": datetime.utcnow().isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "requests": requests,
+            "concurrency": concurrency,
+            "indexmode": config["web"]["indexmode"],
+            "servedirect": config["web"]["servedirect"],
+        },
+        "results": {},
+    }
+    print(
+        f"{'images':>9} {'route':<24} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'req/s':>8}"
+    )
+    for size in sizes:
+        channels = await seed(db, size)
+        await migrate(db)
+        start = time.perf_counter()
+        await app.router.startup()
+        startup = time.perf_counter() - start
+        await reconcile()
+        attachment_ids = [
+            doc["attachment_id"]
+            async for doc in db.image.aggregate(
+                [
+                    {"$sample": {"size": 1000}},
+                    {"$project": {"attachment_id": 1}},
+                ]
+            )
+        ]
+        aliases = [channel["alias"] for channel in channels]
+        size_results = {"startup": {"seconds": startup}}
+        for name, route in routes(aliases, attachment_ids).items():
+            result = await load(app, route, requests, concurrency)
+            size_results[name] = result
+            print(
+                f"{size:>9} {name:<24} {result['p50']:>8.2f} "
+                f"{result['p95']:>8.2f} {result['p99']:>8.2f} "
+                f"{result['rps']:>8.0f}"
+            )
+        await app.router.shutdown()
+        # reseeding creates new channels, drop anything cached
+        channel_cache.invalidate()
+        randomsync_cache.clear()
+        results["results"][str(size)] = size_results
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+    if baseline is not None:
+        with open(baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--uri", default="mongodb://127.0.0.1:27017")
+    parser.add_argument("--database", default="discord2vrc_bench")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--output", default="web-benchmark.json")
+    parser.add_argument(
+        "--compare", help="results of a previous run to compare against"
+    )
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        run(
+            args.uri,
+            args.database,
+            args.sizes,
+            args.requests,
+            args.concurrency,
+            args.output,
+            args.compare,
+        )
+    )
@@ -8,6 +8,7 @@ from discord.ext import commands
 
 from common.config import config
 from common.database import Mongo
+from common.watchdog import Watchdog
 
 
 class Discord2VRCBot(commands.Bot):
@@ -16,8 +17,14 @@ class Discord2VRCBot(commands.Bot):
             self, command_prefix=command_prefix, owner_ids=set(owner_ids)
         )
         Mongo.connect()
+        self.watchdog = Watchdog(config["discord"]["lagthreshold"])
         self._setup_cogs()
 
+    async def start(self, *args, **kwargs) -> None:
+        """Starts the loop watchdog before connecting"""
+        self.watchdog.start()
+        await commands.Bot.start(self, *args, **kwargs)
+
     def _setup_cogs(self) -> None:
         """Loads extensions based on what was loaded
         in previous run
@@ -1,11 +1,15 @@
+import io
 import json
 import discord
 import asyncio
 
 from os import listdir
+from datetime import datetime
 from typing import Optional
 from discord.ext import commands
 
+from common.profiler import SamplingProfiler
+
 
 class AdminCog(commands.Cog, name="Admin"):
     """This extension handles some basic administrative commands"""
@@ -117,12 +121,44 @@ class AdminCog(commands.Cog, name="Admin"):
         """clear channel of bot messages,
         defaults to last 100 messages
         """
+
+        def is_bot(message: discord.Message) -> bool:
+            return message.author.id == self.bot.user.id
+
         async with ctx.channel.typing():
-            for message in await ctx.channel.history(limit=limit).flatten():
-                if message.author.id == self.bot.user.id:
-                    await message.delete()
+            # bulk deletes messages younger than 14 days in batches of 100,
+            # which needs the manage messages permission
+            try:
+                deleted = await ctx.channel.purge(limit=limit, check=is_bot)
+            except discord.Forbidden:
+                deleted = await ctx.channel.purge(
+                    limit=limit, check=is_bot, bulk=False
+                )
         await ctx.message.delete()
-        await ctx.send("Messages cleared!", delete_after=3)
+        await ctx.send(f"{len(deleted)} messages cleared!", delete_after=3)
+
+    @commands.command()
+    async def profile(self, ctx, seconds: float = 10) -> None:
+        """Profiles the bot for some seconds, up to 300, and uploads
+        the stacks for flamegraph.pl or speedscope, eg. !profile 30
+        """
+        await ctx.message.delete()
+        seconds = min(max(seconds, 1), 300)
+        profiler = SamplingProfiler()
+        async with ctx.channel.typing():
+            profiler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.stop()
+        timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        await ctx.send(
+            f"{profiler.samples} samples over {seconds:g}s",
+            file=discord.File(
+                io.BytesIO(profiler.collapsed().encode()),
+                filename=f"bot-{timestamp}.folded",
+            ),
+        )
 
     @commands.command()
     async def quit(self, ctx) -> None:
@@ -1,15 +1,54 @@
-import io
+import time
+import aiohttp
 import discord
 import asyncio
+import hashlib
+import tempfile
 
-from os import path
-from PIL import Image
-from typing import Optional
+from datetime import datetime
+from typing import IO, AsyncIterator, Dict, List, Optional, Set
 from discord.ext import commands
 
 from common.config import config
+from common.bulk import set_deleted, undelete
+from common.counters import adjust, get_count, reconcile
 from common.database import Mongo
-from common.models import ChannelModel, ImageModel
+from common.ingest import (
+    IngestQueue,
+    ingest_seconds,
+    queue_depth,
+    transcode_seconds,
+)
+from common.metrics import registry
+from common.models import (
+    ChannelModel,
+    ImageModel,
+    IngestJobModel,
+    RescanModel,
+)
+from common.scheduler import Priority, Scheduler
+from common.storage import upload_paths
+from common.transcode import ImageRejected, TranscodeResult, Transcoder
+
+
+def parse_bound(value: Optional[str]) -> Optional[datetime]:
+    """Parses a range bound given as a message ID or an ISO date,
+    message IDs are converted to the time they were posted
+    """
+    if value is None:
+        return None
+    if value.isdigit():
+        return discord.utils.snowflake_time(int(value))
+    return datetime.fromisoformat(value)
+
+
+def is_transient(error: Exception) -> bool:
+    """Checks if a download error may succeed if tried again later,
+    eg. server errors and timeouts rather than missing attachments
+    """
+    if isinstance(error, discord.HTTPException):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
 
 
 class ImageCog(commands.Cog, name="Image"):
@@ -17,10 +56,69 @@ class ImageCog(commands.Cog, name="Image"):
 
     exts = [".jpg", ".jpeg", ".png"]
     emoji = {"success": "✅", "loading": "⌛"}
+    page_size = 100
+    chunk_size = 64 * 1024
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        asyncio.ensure_future(self._load_channels())
+        self.pool = Transcoder(
+            config["transcoder"]["workers"],
+            config["transcoder"]["sizes"],
+            config["transcoder"]["perceptualhash"],
+            config["ingest"]["maxpixels"],
+            config["ingest"]["maxedge"],
+        )
+        self.ingest_limit = asyncio.Semaphore(
+            config["ingest"]["concurrency"]
+        )
+        self.session = aiohttp.ClientSession()
+        self.outbound = Scheduler()
+        self.ingest_queue = IngestQueue(
+            self._process_job,
+            config["ingest"]["queueworkers"],
+            config["ingest"]["maxattempts"],
+            config["ingest"]["retrybackoff"],
+        )
+        self.reconciler = asyncio.ensure_future(self._reconcile_counters())
+        self.metrics_writer = asyncio.ensure_future(self._write_metrics())
+        asyncio.ensure_future(self._start())
+
+    def cog_unload(self) -> None:
+        """Shuts down the transcoder pool and download session
+        when cog is unloaded
+        """
+        self.pool.shutdown()
+        self.ingest_queue.stop()
+        self.outbound.shutdown()
+        self.reconciler.cancel()
+        self.metrics_writer.cancel()
+        asyncio.ensure_future(self.session.close())
+
+    async def _reconcile_counters(self) -> None:
+        """Periodically recounts images to fix drift in the counters"""
+        while True:
+            try:
+                await reconcile()
+            except Exception as e:
+                print(f"Counter reconcile failed: {type(e).__name__} - {e}")
+            await asyncio.sleep(config["ingest"]["reconcileinterval"])
+
+    async def _write_metrics(self) -> None:
+        """Periodically writes bot metrics to BotFile under [Metrics]
+        for the textfile collector, if it is set
+        """
+        filename = config["metrics"]["botfile"]
+        if filename is None:
+            return
+        while True:
+            await asyncio.sleep(config["metrics"]["interval"])
+            try:
+                await self.ingest_queue.stats()
+                queue_depth.set(self.pool.queued, queue="transcoder")
+                queue_depth.set(self.outbound.queued(), queue="outbound")
+                registry.write(filename)
+            except Exception as e:
+                print(f"Writing metrics failed: {type(e).__name__} - {e}")
 
     async def _load_channels(self) -> None:
         """Loads channels bot is listening to for images"""
@@ -28,6 +126,29 @@ class ImageCog(commands.Cog, name="Image"):
             int(c.channel_id): c async for c in Mongo.db.find(ChannelModel)
         }
 
+    async def _start(self) -> None:
+        """Loads channels and starts the ingest queue when cog is loaded"""
+        await self._load_channels()
+        await self.ingest_queue.start()
+
+    async def _process_job(self, job: IngestJobModel) -> None:
+        """Ingests a queued message, using the message cache when
+        possible. Jobs of messages or channels that are gone are dropped
+        """
+        await self.bot.wait_until_ready()
+        channel = self.bot.get_channel(int(job.channel_id))
+        if channel is None or not self.is_subscribed(channel.id):
+            return
+        message = discord.utils.get(
+            self.bot.cached_messages, id=int(job.message_id)
+        )
+        if message is None:
+            try:
+                message = await channel.fetch_message(int(job.message_id))
+            except discord.NotFound:
+                return
+        await self._handle_attachments(message)
+
     async def _is_image(self, attachment: discord.Attachment) -> bool:
         """Check if attachment is an image based on exts"""
         for ext in self.exts:
@@ -41,31 +162,123 @@ class ImageCog(commands.Cog, name="Image"):
             return True
         return False
 
-    async def _handle_attachments(self, message: discord.Message) -> int:
-        """Handle processing of attachments for images"""
-        uploaded = 0
-        await message.add_reaction(self.emoji["loading"])
-        for attachment in message.attachments:
-            if await self._is_image(attachment):
-                if await self._upload_exists(attachment):
-                    uploaded += 1
-                elif await self._handle_upload(message, attachment):
-                    uploaded += 1
+    async def _handle_attachment(
+        self,
+        message: discord.Message,
+        attachment: discord.Attachment,
+        existing: Optional[Set[str]] = None,
+    ) -> bool:
+        """Handle processing of a single image attachment, the number
+        of attachments processed at once is bounded across all channels.
+        existing is a set of attachment ids already known to be uploaded,
+        when provided no lookup is made per attachment
+        """
+        async with self.ingest_limit:
+            if existing is not None:
+                if str(attachment.id) in existing:
+                    return True
+            elif await self._upload_exists(attachment):
+                return True
+            return await self._handle_upload(message, attachment)
+
+    async def _handle_attachments(
+        self,
+        message: discord.Message,
+        existing: Optional[Set[str]] = None,
+        priority: Priority = Priority.live,
+    ) -> int:
+        """Handle processing of attachments for images concurrently.
+        The loading reaction is only added if processing takes longer
+        than LoadingDelay, reactions are sent through the scheduler
+        """
+        bucket = ("reactions", message.channel.id)
+        loading = self.outbound.submit(
+            lambda: message.add_reaction(self.emoji["loading"]),
+            bucket,
+            priority,
+            delay=config["discord"]["loadingdelay"],
+        )
+        try:
+            results = await asyncio.gather(
+                *[
+                    self._handle_attachment(message, attachment, existing)
+                    for attachment in message.attachments
+                    if await self._is_image(attachment)
+                ]
+            )
+        finally:
+            # the loading reaction must not outlive a failed attempt
+            if not self.outbound.cancel(loading):
+                self.outbound.submit(
+                    lambda: message.remove_reaction(
+                        self.emoji["loading"], self.bot.user
+                    ),
+                    bucket,
+                    priority,
+                )
+        uploaded = sum(results)
         if uploaded > 0:
-            await message.add_reaction(self.emoji["success"])
-        await message.remove_reaction(self.emoji["loading"], self.bot.user)
+            self.outbound.submit(
+                lambda: message.add_reaction(self.emoji["success"]),
+                bucket,
+                priority,
+            )
         return uploaded
 
     async def _upload_exists(self, attachment: discord.Attachment) -> bool:
-        """Check if image in attachment has already been uploaded"""
-        image = await Mongo.db.find_one(
-            ImageModel, ImageModel.attachment_id == str(attachment.id)
+        """Check if image in attachment has already been uploaded,
+        undeleting it if it was deleted
+        """
+        return bool(await undelete([str(attachment.id)]))
+
+    async def _uploads_exist(self, attachment_ids: List[str]) -> Set[str]:
+        """Check which attachments of a batch have already been uploaded
+        with a single query, undeleting them like _upload_exists
+        """
+        return await undelete(attachment_ids)
+
+    async def _history_pages(
+        self,
+        channel: discord.TextChannel,
+        limit: int,
+        before: Optional[discord.abc.Snowflake] = None,
+    ) -> AsyncIterator[List[discord.Message]]:
+        """Streams channel history newest first in pages of messages"""
+        page: List[discord.Message] = []
+        async for message in channel.history(limit=limit, before=before):
+            page.append(message)
+            if len(page) >= self.page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    async def _rescan_page(self, page: List[discord.Message]) -> int:
+        """Handles a page of messages, checking all of their attachments
+        for duplicates at once
+        """
+        messages = [m for m in page if await self._has_attachments(m)]
+        existing = await self._uploads_exist(
+            [
+                str(attachment.id)
+                for message in messages
+                for attachment in message.attachments
+                if await self._is_image(attachment)
+            ]
         )
-        if image is not None:
-            image.deleted = False
-            await Mongo.db.save(image)
-            return True
-        return False
+        uploaded = 0
+        for message in messages:
+            try:
+                uploaded += await self._handle_attachments(
+                    message, existing, Priority.backfill
+                )
+            except Exception as e:
+                # rescans aren't queued, so there is no retry to leave
+                # transient errors to
+                if not is_transient(e):
+                    raise
+                await message.reply(f"Error downloading images: {e}")
+        return uploaded
 
     async def _alias_exists(self, alias: str) -> bool:
         """Check if channel alias already exists"""
@@ -76,34 +289,116 @@ class ImageCog(commands.Cog, name="Image"):
             return True
         return False
 
-    async def _save_image(self, image_bytes: bytes, filepath: str) -> None:
-        """Converts image to jpg with q=80 and saves to disk"""
-        im = Image.open(io.BytesIO(image_bytes))
-        im_jpg = im.convert("RGB")
-        im_jpg.save(filepath, quality=80)
+    async def _download(
+        self, attachment: discord.Attachment, spool: IO[bytes]
+    ) -> str:
+        """Streams attachment into spool file in chunks, rejecting it
+        if over the byte budget. Returns sha256 of the downloaded bytes
+        """
+        max_bytes = config["ingest"]["maxbytes"]
+        if attachment.size > max_bytes:
+            raise ImageRejected(f"{attachment.size} bytes is over {max_bytes}")
+        digest = hashlib.sha256()
+        received = 0
+        async with self.session.get(attachment.url) as response:
+            if response.status == 404:
+                raise discord.NotFound(response, "attachment not found")
+            if response.status == 403:
+                raise discord.Forbidden(response, "cannot get attachment")
+            if response.status != 200:
+                raise discord.HTTPException(response, "failed to get asset")
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise ImageRejected(f"download is over {max_bytes} bytes")
+                digest.update(chunk)
+                spool.write(chunk)
+        spool.flush()
+        return digest.hexdigest()
+
+    async def _save_image(self, source: str, filepath: str) -> TranscodeResult:
+        """Converts image to jpg with q=80 and saves it to disk along
+        with its derivatives using the transcoder process pool
+        """
+        return await self.pool.submit(source, filepath)
+
+    async def _find_content(self, content_hash: str) -> Optional[dict]:
+        """Finds the stored file of an image with the same content"""
+        images = Mongo.db.get_collection(ImageModel)
+        return await images.find_one(
+            {"sha256": content_hash},
+            {
+                "filepath": 1,
+                "width": 1,
+                "height": 1,
+                "sizes": 1,
+                "filesize": 1,
+                "phash": 1,
+            },
+        )
+
+    async def _store_image(
+        self, source: str, content_hash: str, filename: str
+    ) -> Dict[str, object]:
+        """Stores image, reusing the file of an image with identical
+        content if there is one. Returns ImageModel's file fields
+        """
+        original = await self._find_content(content_hash)
+        if original is not None:
+            original.pop("_id")
+            return {"sha256": content_hash, **original}
+        filepath, relative_uri = upload_paths(filename)
+        result = await self._save_image(source, filepath)
+        megapixels = result.width * result.height / 1e6
+        if megapixels:
+            transcode_seconds.observe(result.elapsed / megapixels)
+        return {
+            "sha256": content_hash,
+            "filepath": relative_uri,
+            "width": result.width,
+            "height": result.height,
+            "sizes": result.sizes,
+            "filesize": result.filesize,
+            "phash": result.phash,
+        }
 
     async def _handle_upload(
         self, message: discord.Message, attachment: discord.Attachment
     ) -> bool:
-        """Handles the upload of image attachments"""
+        """Handles the upload of image attachments, replying with the
+        reason when it fails for good. Transient download errors are
+        raised so that the ingest queue retries the message
+        """
         try:
             filename = str(attachment.id) + ".jpg"
-            filepath = path.join(config["directories"]["uploadsdir"], filename)
-            relative_uri = path.join(
-                config["directories"]["uploadsfolder"], filename
-            )
-            image_bytes = await attachment.read()
-            await self._save_image(image_bytes, filepath)
-        except discord.HTTPException:
-            await message.reply(f"Error downloading image: {attachment.id}")
+            with tempfile.NamedTemporaryFile(
+                dir=config["ingest"]["spooldir"]
+            ) as spool:
+                started = time.perf_counter()
+                content_hash = await self._download(attachment, spool)
+                ingest_seconds.observe(
+                    time.perf_counter() - started, stage="download"
+                )
+                started = time.perf_counter()
+                stored = await self._store_image(
+                    spool.name, content_hash, filename
+                )
+                ingest_seconds.observe(
+                    time.perf_counter() - started, stage="store"
+                )
+        except ImageRejected as e:
+            await message.reply(f"Image rejected: {attachment.id} - {e}")
         except discord.NotFound:
             await message.channel.send(
                 f"Attachment not found: {attachment.id}"
             )
+        except discord.HTTPException as e:
+            if is_transient(e):
+                raise
+            await message.reply(f"Error downloading image: {attachment.id}")
         else:
             image = ImageModel(
                 filename=attachment.filename,
-                filepath=relative_uri,
                 attachment_id=attachment.id,
                 username=message.author.name,
                 user_num=message.author.discriminator,
@@ -111,8 +406,12 @@ class ImageCog(commands.Cog, name="Image"):
                 message_id=message.id,
                 created_at=message.created_at,
                 channel=self.channels[message.channel.id],
+                **stored,
             )
+            started = time.perf_counter()
             await Mongo.db.save(image)
+            ingest_seconds.observe(time.perf_counter() - started, stage="save")
+            await adjust(image.channel.id, active=1)
             return True
         return False
 
@@ -134,38 +433,80 @@ class ImageCog(commands.Cog, name="Image"):
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message) -> None:
-        """Reads every message in subscribed channels for images"""
+        """Reads every message in subscribed channels for images,
+        queueing those with image attachments for ingest
+        """
         if message.author.id == self.bot.user.id:
             return
         if self.is_subscribed(message.channel.id):
-            if await self._has_attachments(message):
-                await self._handle_attachments(message)
+            attachments = [
+                attachment.id
+                for attachment in message.attachments
+                if await self._is_image(attachment)
+            ]
+            if attachments:
+                await self.ingest_queue.enqueue(
+                    message.channel.id, message.id, attachments
+                )
 
     @commands.command()
-    async def rescan(self, ctx, limit: int = 100) -> None:
-        """Rescans current channel for images if it is subscribed"""
+    async def rescan(self, ctx, limit: int = 100, resume: bool = True) -> None:
+        """Rescans current channel for images if it is subscribed,
+        continues an interrupted rescan unless resume is set to false
+        """
         await ctx.message.delete()
         if not self.is_subscribed(ctx.channel.id):
             await ctx.send("This channel is not subscribed!", delete_after=3)
             return
+        channel = self.channels[ctx.channel.id]
+        checkpoint = await Mongo.db.find_one(
+            RescanModel, RescanModel.channel == channel.id
+        )
+        if checkpoint is not None and resume:
+            await ctx.send(
+                f"Resuming rescan, {checkpoint.remaining} messages left",
+                delete_after=3,
+            )
+        else:
+            if checkpoint is not None:
+                await Mongo.db.delete(checkpoint)
+            checkpoint = RescanModel(
+                channel=channel,
+                last_message_id=str(ctx.message.id),
+                remaining=limit,
+            )
+            await Mongo.db.save(checkpoint)
+        count = checkpoint.remaining
         async with ctx.channel.typing():
-            uploaded = 0
-            messages = await ctx.channel.history(limit=limit + 1).flatten()
-            count = len(messages)
             response = await ctx.send(
                 f"Rescanning the last {count} messages for images"
             )
             current = 0
             progress = await ctx.send(content=f"Progress {current}/{count}")
-            for message in messages[::-1]:
-                if await self._has_attachments(message):
-                    uploaded += await self._handle_attachments(message)
-                current += 1
-                await progress.edit(content=f"Progress {current}/{count}")
+            edit = None
+            before = discord.Object(id=int(checkpoint.last_message_id))
+            async for page in self._history_pages(ctx.channel, count, before):
+                checkpoint.uploaded += await self._rescan_page(page)
+                checkpoint.last_message_id = str(page[-1].id)
+                checkpoint.remaining -= len(page)
+                await Mongo.db.save(checkpoint)
+                current += len(page)
+                content = f"Progress {current}/{count}"
+                # pending edits are merged so only the latest is sent
+                edit = self.outbound.submit(
+                    lambda content=content: progress.edit(content=content),
+                    ("messages", ctx.channel.id),
+                    Priority.progress,
+                    key=("progress", progress.id),
+                )
+            await Mongo.db.delete(checkpoint)
+            if edit is not None and not self.outbound.cancel(edit):
+                await asyncio.wait([edit])
             await response.delete()
             await progress.delete()
         await ctx.send(
-            f"Rescan complete, added {uploaded} new images", delete_after=3
+            f"Rescan complete, added {checkpoint.uploaded} new images",
+            delete_after=3,
         )
 
     @commands.command()
@@ -257,47 +598,168 @@ class ImageCog(commands.Cog, name="Image"):
             await ctx.send("This channel is not subscribed", delete_after=3)
             return
         channel = self.channels[ctx.channel.id]
-        count = await Mongo.db.count(
-            ImageModel,
-            (ImageModel.deleted == False) & (ImageModel.channel == channel.id),
-        )
+        count = await get_count(channel.id, deleted=False)
         await ctx.send(
             f"There are currently {count} images from this channel "
             f'indexed under the alias "{channel.alias}"',
             delete_after=5,
         )
 
-    @commands.command()
-    async def purge(self, ctx) -> None:
-        """Soft deletes all images downloaded from this channel"""
+    async def _set_deleted(
+        self,
+        ctx,
+        deleted: bool,
+        start: Optional[str],
+        end: Optional[str],
+    ) -> None:
+        """Soft deletes or restores images of this channel, optionally
+        only those posted between start and end
+        """
         if not self.was_subscribed(ctx):
             return
         await ctx.message.delete()
+        try:
+            bounds = [parse_bound(value) for value in (start, end)]
+        except ValueError:
+            await ctx.send(
+                "Range bounds must be message IDs or ISO dates, "
+                "eg. 2021-05-01 or 2021-05-01T12:00",
+                delete_after=5,
+            )
+            return
         channel = self.channels[ctx.channel.id]
-        images = await Mongo.db.find(
-            ImageModel,
-            (ImageModel.deleted == False) & (ImageModel.channel == channel.id),
-        )
-        for image in images:
-            image.deleted = True
-        await Mongo.db.save_all(images)
+        changed = await set_deleted(channel.id, deleted, *bounds)
+        action = "purged" if deleted else "restored"
         await ctx.send(
-            f"{len(images)} images from this channel have been purged",
+            f"{changed} images from this channel have been {action}",
             delete_after=3,
         )
 
+    @commands.command()
+    async def purge(
+        self, ctx, start: Optional[str] = None, end: Optional[str] = None
+    ) -> None:
+        """Soft deletes all images downloaded from this channel,
+        or those posted between two message IDs or dates, inclusive,
+        eg. !purge 2021-05-01 2021-06-01
+        """
+        await self._set_deleted(ctx, True, start, end)
+
+    @commands.command()
+    async def restore(
+        self, ctx, start: Optional[str] = None, end: Optional[str] = None
+    ) -> None:
+        """Restores purged images of this channel, takes the same range
+        as purge
+        """
+        await self._set_deleted(ctx, False, start, end)
+
+    @commands.command()
+    async def transcoder(self, ctx) -> None:
+        """Shows transcoder pool queue depth and job timings"""
+        await ctx.message.delete()
+        stats = self.pool.stats()
+        embed = discord.Embed(title="Transcoder")
+        embed.add_field(
+            name="Workers",
+            value=f"{stats['active']}/{stats['workers']} busy",
+        )
+        embed.add_field(name="Queued", value=str(stats["queued"]))
+        embed.add_field(name="Completed", value=str(stats["completed"]))
+        embed.add_field(
+            name="Job time",
+            value=f"avg {stats['avg']:.2f}s, p95 {stats['p95']:.2f}s, "
+            f"max {stats['max']:.2f}s",
+            inline=False,
+        )
+        embed.add_field(
+            name="Queue wait", value=f"avg {stats['wait']:.2f}s", inline=False
+        )
+        await ctx.send(embed=embed, delete_after=30)
+
+    @commands.command()
+    async def queue(self, ctx) -> None:
+        """Shows ingest queue depth and throughput"""
+        await ctx.message.delete()
+        stats = await self.ingest_queue.stats()
+        embed = discord.Embed(title="Ingest queue")
+        embed.add_field(
+            name="Workers",
+            value=f"{stats['in_flight']}/{stats['workers']} busy",
+        )
+        embed.add_field(name="Ready", value=str(stats["ready"]))
+        embed.add_field(name="Retrying", value=str(stats["retrying"]))
+        embed.add_field(name="Failed", value=str(stats["failed"]))
+        embed.add_field(name="Oldest", value=f"{stats['oldest']:.0f}s")
+        embed.add_field(
+            name="Throughput",
+            value=f"{stats['per_minute']:.1f}/min, {stats['total']} total",
+        )
+        await ctx.send(embed=embed, delete_after=30)
+
+    @commands.command()
+    async def dedupe(self, ctx) -> None:
+        """Shows disk space saved by reusing files of identical images"""
+        await ctx.message.delete()
+        images = Mongo.db.get_collection(ImageModel)
+        result = await images.aggregate(
+            [
+                {"$match": {"filesize": {"$ne": None}}},
+                {
+                    "$group": {
+                        "_id": "$filepath",
+                        "count": {"$sum": 1},
+                        "filesize": {"$first": "$filesize"},
+                    }
+                },
+                {"$match": {"count": {"$gt": 1}}},
+                {
+                    "$group": {
+                        "_id": None,
+                        "files": {"$sum": 1},
+                        "reused": {"$sum": {"$subtract": ["$count", 1]}},
+                        "saved": {
+                            "$sum": {
+                                "$multiply": [
+                                    {"$subtract": ["$count", 1]},
+                                    "$filesize",
+                                ]
+                            }
+                        },
+                    }
+                },
+            ]
+        ).to_list(length=1)
+        if not result:
+            await ctx.send("No duplicate images stored yet", delete_after=5)
+            return
+        saved = result[0]["saved"] / (1024 * 1024)
+        await ctx.send(
+            f"{result[0]['reused']} duplicate images reuse "
+            f"{result[0]['files']} stored files, saving {saved:.1f} MiB",
+            delete_after=10,
+        )
+
     @commands.command()
     async def reactclear(self, ctx, limit: Optional[int] = 100) -> None:
         """Clear bot reactions from this channel,
         defaults to last 100 messages
         """
+        removals = []
         async with ctx.channel.typing():
-            for message in await ctx.channel.history(limit=limit).flatten():
+            async for message in ctx.channel.history(limit=limit):
                 for reaction in message.reactions:
                     if reaction.me:
-                        await reaction.remove(self.bot.user)
+                        removals.append(
+                            self.outbound.submit(
+                                lambda r=reaction: r.remove(self.bot.user),
+                                ("reactions", ctx.channel.id),
+                                Priority.backfill,
+                            )
+                        )
+            await asyncio.gather(*removals, return_exceptions=True)
         await ctx.message.delete()
-        await ctx.send("Reactions cleared!", delete_after=3)
+        await ctx.send(f"{len(removals)} reactions cleared!", delete_after=3)
 
 
 def setup(bot):
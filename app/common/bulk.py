@@ -0,0 +1,68 @@
+from datetime import datetime
+from collections import Counter
+from typing import List, Optional, Set
+
+from bson.objectid import ObjectId
+
+from common.counters import adjust
+from common.database import Mongo
+from common.models import ImageModel
+
+
+async def set_deleted(
+    channel_id: ObjectId,
+    deleted: bool,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> int:
+    """Soft deletes or restores the images of a channel with one update,
+    only those created between start and end if given.
+    Returns the number of images changed
+    """
+    query: dict = {"channel": channel_id, "deleted": not deleted}
+    created_at = {}
+    if start is not None:
+        created_at["$gte"] = start
+    if end is not None:
+        created_at["$lte"] = end
+    if created_at:
+        query["created_at"] = created_at
+    images = Mongo.db.get_collection(ImageModel)
+    result = await images.update_many(
+        query, {"$set": {"deleted": deleted, "updated_at": datetime.utcnow()}}
+    )
+    changed = result.modified_count
+    if changed:
+        if deleted:
+            await adjust(channel_id, active=-changed, deleted=changed)
+        else:
+            await adjust(channel_id, active=changed, deleted=-changed)
+    return changed
+
+
+async def undelete(attachment_ids: List[str]) -> Set[str]:
+    """Restores the images of attachments that were deleted, leaving
+    the others untouched. Returns the attachment ids already stored
+    """
+    if not attachment_ids:
+        return set()
+    images = Mongo.db.get_collection(ImageModel)
+    docs = await images.find(
+        {"attachment_id": {"$in": attachment_ids}},
+        {"attachment_id": 1, "channel": 1, "deleted": 1},
+    ).to_list(length=None)
+    deleted = [doc for doc in docs if doc["deleted"]]
+    if deleted:
+        await images.update_many(
+            {
+                "attachment_id": {
+                    "$in": [doc["attachment_id"] for doc in deleted]
+                },
+                "deleted": True,
+            },
+            {"$set": {"deleted": False, "updated_at": datetime.utcnow()}},
+        )
+        channels = Counter(doc["channel"] for doc in deleted)
+        for channel_id, restored in channels.items():
+            await adjust(channel_id, active=restored, deleted=-restored)
+    return {doc["attachment_id"] for doc in docs}
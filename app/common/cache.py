@@ -0,0 +1,56 @@
+import time
+import asyncio
+
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class WindowCache:
+    """Caches results until an expiry time. Concurrent misses for the
+    same key share a single in-flight computation
+    """
+
+    def __init__(self, evict_interval: float = 1.0):
+        self.entries: Dict[Hashable, Tuple[float, asyncio.Future]] = {}
+        self.evict_interval = evict_interval
+        self.evicted_at = 0.0
+
+    def _evict(self, now: float) -> None:
+        """Drops expired entries, at most once per evict_interval"""
+        if now - self.evicted_at < self.evict_interval:
+            return
+        self.evicted_at = now
+        expired = [k for k, (exp, _) in self.entries.items() if exp <= now]
+        for key in expired:
+            del self.entries[key]
+
+    def _discard_failed(self, key: Hashable, future: asyncio.Future) -> None:
+        """Forgets a failed computation so the next request retries"""
+        if future.cancelled() or future.exception() is not None:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is future:
+                del self.entries[key]
+
+    async def get(
+        self,
+        key: Hashable,
+        expires_at: float,
+        factory: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Gets cached result for key, computing it with factory on a miss.
+        expires_at is a unix timestamp after which the result is dropped
+        """
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= now:
+            self._evict(now)
+            future = asyncio.ensure_future(factory())
+            future.add_done_callback(
+                lambda f: self._discard_failed(key, f)
+            )
+            entry = (expires_at, future)
+            self.entries[key] = entry
+        return await asyncio.shield(entry[1])
+
+    def clear(self) -> None:
+        """Drops all entries"""
+        self.entries.clear()
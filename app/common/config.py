@@ -7,12 +7,58 @@ from urllib.parse import quote_plus
 
 CONFIG_DIR = "../config.ini"
 
+# settings added after the original config.ini, so existing installs
+# keep working without adding them
+DEFAULTS = {
+    "Database": {"Uri": ""},
+    "Discord": {"LoadingDelay": "2", "LagThreshold": "0.5"},
+    "Transcoder": {
+        "Workers": "2",
+        "Sizes": "512 1024 2048",
+        "PerceptualHash": "true",
+    },
+    "Ingest": {
+        "Concurrency": "8",
+        "MaxBytes": "52428800",
+        "MaxPixels": "89478485",
+        "MaxEdge": "8192",
+        "SpoolDir": "",
+        "ReconcileInterval": "3600",
+        "QueueWorkers": "4",
+        "MaxAttempts": "5",
+        "RetryBackoff": "30",
+    },
+    "Web": {
+        "IndexRefresh": "5",
+        "LagThreshold": "0.1",
+        "IndexMode": "memory",
+        "IndexFile": "../images.idx",
+        "AliasTTL": "60",
+        "AliasNegativeTTL": "10",
+        "ServeDirect": "false",
+        "OrderedMaxAge": "86400",
+        "LatestMaxAge": "30",
+        "ProfileToken": "",
+    },
+    "Metrics": {"BotFile": "", "Interval": "15"},
+}
+
 
 def parse_owners(owners: str) -> List[int]:
     """Parse owner list from config file"""
     return [int(owner) for owner in owners.split("\n")]
 
 
+def parse_sizes(sizes: str) -> List[int]:
+    """Parse list of derivative sizes from config file"""
+    return sorted(int(size) for size in sizes.split())
+
+
+def parse_bool(value: str) -> bool:
+    """Parse boolean from config file"""
+    return value.strip().lower() in ("1", "yes", "true", "on")
+
+
 def to_dict(cfg: configparser.ConfigParser) -> dict:
     """Converts ConfigParser object into dictionary"""
     return {s.lower(): dict(cfg[s]) for s in cfg.sections()}
@@ -23,10 +69,49 @@ def setup_config() -> dict:
     parsed configuration
     """
     cfg = configparser.ConfigParser()
+    cfg.read_dict(DEFAULTS)
     cfg.read(CONFIG_DIR)
     config = to_dict(cfg)
     config["discord"]["owners"] = parse_owners(config["discord"]["owners"])
+    config["discord"]["loadingdelay"] = float(
+        config["discord"]["loadingdelay"]
+    )
+    config["discord"]["lagthreshold"] = float(
+        config["discord"]["lagthreshold"]
+    )
     config["database"]["password"] = quote_plus(config["database"]["password"])
+    config["database"]["uri"] = config["database"]["uri"] or None
+    config["transcoder"]["workers"] = int(config["transcoder"]["workers"])
+    config["transcoder"]["sizes"] = parse_sizes(config["transcoder"]["sizes"])
+    config["transcoder"]["perceptualhash"] = parse_bool(
+        config["transcoder"]["perceptualhash"]
+    )
+    config["ingest"]["concurrency"] = int(config["ingest"]["concurrency"])
+    config["ingest"]["maxbytes"] = int(config["ingest"]["maxbytes"])
+    config["ingest"]["maxpixels"] = int(config["ingest"]["maxpixels"])
+    config["ingest"]["maxedge"] = int(config["ingest"]["maxedge"])
+    config["ingest"]["queueworkers"] = int(config["ingest"]["queueworkers"])
+    config["ingest"]["maxattempts"] = int(config["ingest"]["maxattempts"])
+    config["ingest"]["retrybackoff"] = float(
+        config["ingest"]["retrybackoff"]
+    )
+    config["ingest"]["reconcileinterval"] = float(
+        config["ingest"]["reconcileinterval"]
+    )
+    config["ingest"]["spooldir"] = config["ingest"]["spooldir"] or None
+    config["web"]["indexrefresh"] = float(config["web"]["indexrefresh"])
+    config["web"]["aliasttl"] = float(config["web"]["aliasttl"])
+    config["web"]["aliasnegativettl"] = float(
+        config["web"]["aliasnegativettl"]
+    )
+    config["web"]["profiletoken"] = config["web"]["profiletoken"] or None
+    config["web"]["lagthreshold"] = float(config["web"]["lagthreshold"])
+    config["web"]["indexmode"] = config["web"]["indexmode"].strip().lower()
+    config["web"]["servedirect"] = parse_bool(config["web"]["servedirect"])
+    config["web"]["orderedmaxage"] = int(config["web"]["orderedmaxage"])
+    config["web"]["latestmaxage"] = int(config["web"]["latestmaxage"])
+    config["metrics"]["botfile"] = config["metrics"]["botfile"] or None
+    config["metrics"]["interval"] = float(config["metrics"]["interval"])
     config["directories"]["uploadsdir"] = path.join(
         config["directories"]["staticdir"],
         config["directories"]["uploadsfolder"],
@@ -0,0 +1,81 @@
+from typing import Dict, Optional
+
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+from common.database import Mongo
+from common.models import CounterModel, ImageModel
+
+ALL = "all"
+
+
+async def adjust(
+    channel_id: ObjectId, active: int = 0, deleted: int = 0
+) -> None:
+    """Atomically adjusts the image counts of a channel and of all
+    channels by the differences given
+    """
+    counters = Mongo.db.get_collection(CounterModel)
+    update = {"$inc": {"active": active, "deleted": deleted}}
+    await counters.bulk_write(
+        [
+            UpdateOne({"_id": str(channel_id)}, update, upsert=True),
+            UpdateOne({"_id": ALL}, update, upsert=True),
+        ],
+        ordered=False,
+    )
+
+
+async def get_count(
+    channel_id: Optional[ObjectId] = None, deleted: Optional[bool] = None
+) -> int:
+    """Number of images in a channel, or all channels if None.
+    deleted None counts both deleted and not deleted images.
+    Counts directly if the counters haven't been set up yet
+    """
+    counters = Mongo.db.get_collection(CounterModel)
+    key = ALL if channel_id is None else str(channel_id)
+    counter = await counters.find_one({"_id": key})
+    if counter is None:
+        queries = []
+        if channel_id is not None:
+            queries.append(ImageModel.channel == channel_id)
+        if deleted is not None:
+            queries.append(ImageModel.deleted == deleted)
+        return await Mongo.db.count(ImageModel, *queries)
+    if deleted is None:
+        return counter["active"] + counter["deleted"]
+    return counter["deleted"] if deleted else counter["active"]
+
+
+async def reconcile() -> None:
+    """Recounts images per channel and overwrites the counters,
+    fixing any drift from missed or duplicated adjustments
+    """
+    images = Mongo.db.get_collection(ImageModel)
+    counts: Dict[str, Dict[str, int]] = {ALL: {"active": 0, "deleted": 0}}
+    async for doc in images.aggregate(
+        [
+            {
+                "$group": {
+                    "_id": {"channel": "$channel", "deleted": "$deleted"},
+                    "count": {"$sum": 1},
+                }
+            }
+        ]
+    ):
+        field = "deleted" if doc["_id"]["deleted"] else "active"
+        channel = counts.setdefault(
+            str(doc["_id"]["channel"]), {"active": 0, "deleted": 0}
+        )
+        channel[field] += doc["count"]
+        counts[ALL][field] += doc["count"]
+    counters = Mongo.db.get_collection(CounterModel)
+    await counters.bulk_write(
+        [
+            ReplaceOne({"_id": key}, {"_id": key, **value}, upsert=True)
+            for key, value in counts.items()
+        ],
+        ordered=False,
+    )
+    await counters.delete_many({"_id": {"$nin": list(counts)}})
@@ -2,6 +2,18 @@ from odmantic import AIOEngine
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from common.config import config
+from common.metrics import MongoListener
+
+
+def database_uri() -> str:
+    """Connection URI from Uri under [Database] if it is set,
+    otherwise built from the host and credentials
+    """
+    uri = config["database"]["uri"]
+    if uri is None:
+        uri = "mongodb://{username}:{password}@{host}:{port}/{database}"
+        uri = uri.format(**config["database"])
+    return uri
 
 
 class Mongo:
@@ -15,9 +27,7 @@ class Mongo:
         and Odmantic's AIOEngine
         """
         Mongo.motor = AsyncIOMotorClient(
-            "mongodb://{username}:{password}@{host}:{port}/{database}".format(
-                **config["database"]
-            )
+            database_uri(), event_listeners=[MongoListener()]
         )
         Mongo.db = AIOEngine(
             motor_client=Mongo.motor, database=config["database"]["database"]
@@ -0,0 +1,379 @@
+import os
+import mmap
+import struct
+import asyncio
+
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from common.config import config
+from common.database import Mongo
+from common.models import ImageModel
+from common.utils import Order
+
+
+class IndexEntry(NamedTuple):
+    attachment_id: str
+    filepath: str
+    sizes: Tuple[int, ...] = ()
+    long_edge: int = 0
+
+
+def entry_from_doc(doc: dict) -> IndexEntry:
+    """Creates index entry from an image document"""
+    long_edge = max(doc.get("width") or 0, doc.get("height") or 0)
+    return IndexEntry(
+        doc["attachment_id"],
+        doc["filepath"],
+        tuple(doc.get("sizes") or ()),
+        long_edge,
+    )
+
+
+class ImageIndex:
+    """In-memory index of non-deleted images sorted by attachment id,
+    kept for all images and for each channel. Loaded once on startup
+    and kept fresh by polling for documents with a newer updated_at
+    """
+
+    projection = {
+        "attachment_id": 1,
+        "filepath": 1,
+        "channel": 1,
+        "deleted": 1,
+        "updated_at": 1,
+        "sizes": 1,
+        "width": 1,
+        "height": 1,
+    }
+    # writes can land slightly after their updated_at timestamp,
+    # so every refresh looks back a little further than the watermark
+    overlap = timedelta(seconds=5)
+
+    def __init__(self):
+        self.all: List[IndexEntry] = []
+        self.channels: Dict[str, List[IndexEntry]] = {}
+        # moved forward by load and refresh from updated_at, which is
+        # stamped with the bot's clock and not comparable to this host's
+        self.watermark = datetime.min
+        self.generation = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def _entries(self, channel_id: Optional[str]) -> List[IndexEntry]:
+        """Gets the sorted entries for a channel, or all if None"""
+        if channel_id is None:
+            return self.all
+        return self.channels.get(str(channel_id), [])
+
+    def count(self, channel_id: Optional[str] = None) -> int:
+        """Number of non-deleted images"""
+        return len(self._entries(channel_id))
+
+    def get(
+        self, index: int, order: Order, channel_id: Optional[str] = None
+    ) -> Optional[IndexEntry]:
+        """Gets the image at index in the order specified"""
+        entries = self._entries(channel_id)
+        if index >= len(entries):
+            return None
+        if order == Order.desc:
+            return entries[-1 - index]
+        return entries[index]
+
+    def _track(self, doc: dict) -> None:
+        """Moves the watermark forward to the doc's updated_at"""
+        updated_at = doc.get("updated_at")
+        if updated_at is not None and updated_at > self.watermark:
+            self.watermark = updated_at
+
+    @staticmethod
+    def _remove(entries: List[IndexEntry], attachment_id: str) -> bool:
+        """Removes an entry from a sorted list if present,
+        returns whether the list changed
+        """
+        i = bisect_left(entries, (attachment_id,))
+        if i < len(entries) and entries[i].attachment_id == attachment_id:
+            del entries[i]
+            return True
+        return False
+
+    @staticmethod
+    def _insert(entries: List[IndexEntry], entry: IndexEntry) -> bool:
+        """Inserts or replaces an entry in a sorted list,
+        returns whether the list changed
+        """
+        attachment_id = entry.attachment_id
+        i = bisect_left(entries, (attachment_id,))
+        if i < len(entries) and entries[i].attachment_id == attachment_id:
+            if entries[i] == entry:
+                return False
+            entries[i] = entry
+        else:
+            entries.insert(i, entry)
+        return True
+
+    def _apply(self, doc: dict) -> None:
+        """Applies a changed image document to the index,
+        bumping the generation if anything changed
+        """
+        channel = self.channels.setdefault(str(doc["channel"]), [])
+        if doc.get("deleted", False):
+            changed = self._remove(self.all, doc["attachment_id"])
+            changed |= self._remove(channel, doc["attachment_id"])
+        else:
+            entry = entry_from_doc(doc)
+            changed = self._insert(self.all, entry)
+            changed |= self._insert(channel, entry)
+        if changed:
+            self.generation += 1
+        self._track(doc)
+
+    async def load(self) -> None:
+        """Loads every non-deleted image into the index"""
+        images = Mongo.db.get_collection(ImageModel)
+        entries: List[IndexEntry] = []
+        channels: Dict[str, List[IndexEntry]] = {}
+        async for doc in images.find({"deleted": False}, self.projection):
+            entry = entry_from_doc(doc)
+            entries.append(entry)
+            channels.setdefault(str(doc["channel"]), []).append(entry)
+            self._track(doc)
+        entries.sort()
+        for channel in channels.values():
+            channel.sort()
+        self.all, self.channels = entries, channels
+        self.generation += 1
+
+    async def refresh(self) -> None:
+        """Applies images changed since the last load or refresh"""
+        images = Mongo.db.get_collection(ImageModel)
+        since = max(self.watermark, datetime.min + self.overlap)
+        since -= self.overlap
+        async for doc in images.find(
+            {"updated_at": {"$gte": since}}, self.projection
+        ):
+            self._apply(doc)
+
+    async def _refresh_forever(self, interval: float) -> None:
+        """Refreshes index every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Image index refresh failed: {type(e).__name__} - {e}")
+
+    async def start(self) -> None:
+        """Loads the index and starts refreshing it in the background"""
+        await self.load()
+        self.task = asyncio.ensure_future(
+            self._refresh_forever(config["web"]["indexrefresh"])
+        )
+
+    async def stop(self) -> None:
+        """Stops background refreshing"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+# binary index file published by indexer.py and mapped by web workers:
+# header, derivative sizes, channel table, records sorted by attachment
+# id, per channel lists of record numbers and the filepaths
+MAGIC = b"D2VIDX01"
+HEADER = struct.Struct("<8sIII")  # magic, records, channels, sizes
+SIZE = struct.Struct("<I")
+CHANNEL = struct.Struct("<24sII")  # channel id, first member, members
+# attachment id, filepath offset, filepath length, long edge, sizes mask
+RECORD = struct.Struct("<QIIII")
+MEMBER = struct.Struct("<I")
+
+
+def write_index(
+    filename: str,
+    entries: List[IndexEntry],
+    channels: Dict[str, List[IndexEntry]],
+) -> None:
+    """Writes entries sorted by attachment id to an index file,
+    replacing any existing file atomically so readers only ever map
+    either the old or the new index
+    """
+    sizes = sorted({size for entry in entries for size in entry.sizes})
+    if len(sizes) > 32:
+        raise ValueError("index files support up to 32 derivative sizes")
+    bits = {size: 1 << i for i, size in enumerate(sizes)}
+    record_of = {entry.attachment_id: i for i, entry in enumerate(entries)}
+    strings = bytearray()
+    records = bytearray()
+    for entry in entries:
+        filepath = entry.filepath.encode()
+        mask = 0
+        for size in entry.sizes:
+            mask |= bits[size]
+        records += RECORD.pack(
+            int(entry.attachment_id),
+            len(strings),
+            len(filepath),
+            entry.long_edge,
+            mask,
+        )
+        strings += filepath
+    table = bytearray()
+    members = bytearray()
+    first = 0
+    for channel_id, channel in channels.items():
+        table += CHANNEL.pack(channel_id.encode(), first, len(channel))
+        for entry in channel:
+            members += MEMBER.pack(record_of[entry.attachment_id])
+        first += len(channel)
+    temp = f"{filename}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries), len(channels), len(sizes)))
+        for size in sizes:
+            f.write(SIZE.pack(size))
+        f.write(table)
+        f.write(records)
+        f.write(members)
+        f.write(strings)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, filename)
+
+
+class IndexMapping:
+    """A memory mapped index file, entries are decoded on lookup"""
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as f:
+            stat_result = os.fstat(f.fileno())
+            self.identity = (stat_result.st_ino, stat_result.st_mtime_ns)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.records, channels, sizes = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{filename} is not an image index file")
+        offset = HEADER.size
+        self.sizes = [
+            SIZE.unpack_from(self.mm, offset + i * SIZE.size)[0]
+            for i in range(sizes)
+        ]
+        offset += sizes * SIZE.size
+        self.channels: Dict[str, Tuple[int, int]] = {}
+        members = 0
+        for i in range(channels):
+            channel_id, first, count = CHANNEL.unpack_from(
+                self.mm, offset + i * CHANNEL.size
+            )
+            self.channels[channel_id.decode()] = (first, count)
+            members += count
+        self.records_at = offset + channels * CHANNEL.size
+        self.members_at = self.records_at + self.records * RECORD.size
+        self.strings_at = self.members_at + members * MEMBER.size
+
+    def count(self, channel_id: Optional[str] = None) -> int:
+        """Number of images in a channel, or all if None"""
+        if channel_id is None:
+            return self.records
+        return self.channels.get(str(channel_id), (0, 0))[1]
+
+    def get(
+        self, index: int, order: Order, channel_id: Optional[str] = None
+    ) -> Optional[IndexEntry]:
+        """Gets the image at index in the order specified"""
+        count = self.count(channel_id)
+        if index >= count:
+            return None
+        if order == Order.desc:
+            index = count - 1 - index
+        if channel_id is not None:
+            first = self.channels[str(channel_id)][0]
+            index = MEMBER.unpack_from(
+                self.mm, self.members_at + (first + index) * MEMBER.size
+            )[0]
+        attachment_id, start, length, long_edge, mask = RECORD.unpack_from(
+            self.mm, self.records_at + index * RECORD.size
+        )
+        start += self.strings_at
+        return IndexEntry(
+            str(attachment_id),
+            self.mm[start : start + length].decode(),
+            tuple(s for i, s in enumerate(self.sizes) if mask & (1 << i)),
+            long_edge,
+        )
+
+    def close(self) -> None:
+        self.mm.close()
+
+
+class MappedIndex:
+    """Image index read from a file published by indexer.py, so any
+    number of web workers share one copy through the page cache.
+    The file is checked for replacement every IndexRefresh seconds
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.mapping: Optional[IndexMapping] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def count(self, channel_id: Optional[str] = None) -> int:
+        """Number of non-deleted images"""
+        if self.mapping is None:
+            return 0
+        return self.mapping.count(channel_id)
+
+    def get(
+        self, index: int, order: Order, channel_id: Optional[str] = None
+    ) -> Optional[IndexEntry]:
+        """Gets the image at index in the order specified"""
+        if self.mapping is None:
+            return None
+        return self.mapping.get(index, order, channel_id)
+
+    def remap(self) -> None:
+        """Maps the index file again if it has been replaced"""
+        try:
+            stat_result = os.stat(self.filename)
+        except FileNotFoundError:
+            return
+        identity = (stat_result.st_ino, stat_result.st_mtime_ns)
+        if self.mapping is not None and self.mapping.identity == identity:
+            return
+        old, self.mapping = self.mapping, IndexMapping(self.filename)
+        if old is not None:
+            old.close()
+
+    async def _remap_forever(self, interval: float) -> None:
+        """Checks for a new index file every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.remap()
+            except Exception as e:
+                print(f"Image index remap failed: {type(e).__name__} - {e}")
+
+    async def start(self) -> None:
+        """Maps the index file and starts watching for replacements"""
+        self.remap()
+        if self.mapping is None:
+            print(f"Image index {self.filename} not found, is indexer.py up?")
+        self.task = asyncio.ensure_future(
+            self._remap_forever(config["web"]["indexrefresh"])
+        )
+
+    async def stop(self) -> None:
+        """Stops watching and unmaps the index file"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+image_index: Union[ImageIndex, MappedIndex]
+if config["web"]["indexmode"] == "mmap":
+    image_index = MappedIndex(config["web"]["indexfile"])
+else:
+    image_index = ImageIndex()
@@ -0,0 +1,205 @@
+import time
+import asyncio
+
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, List, Optional
+
+from pymongo import ReturnDocument
+
+from common.database import Mongo
+from common.metrics import registry
+from common.models import IngestJobModel
+
+Handler = Callable[[IngestJobModel], Awaitable[None]]
+
+ingest_jobs = registry.counter(
+    "ingest_jobs_total", "Ingest jobs handled by outcome", ("outcome",)
+)
+ingest_seconds = registry.histogram(
+    "ingest_stage_seconds",
+    "Time spent in each stage of ingesting an attachment",
+    ("stage",),
+)
+transcode_seconds = registry.histogram(
+    "transcode_seconds_per_megapixel",
+    "Transcoder process time per megapixel of the stored image",
+)
+queue_depth = registry.gauge(
+    "bot_queue_depth", "Work waiting in the bot's queues", ("queue",)
+)
+
+
+class IngestQueue:
+    """Durable queue of messages to ingest, stored in MongoDB so work
+    survives restarts. A pool of workers claims jobs oldest first and
+    retries failed ones with exponential backoff, giving up after
+    max_attempts. Only one bot process may drain the queue, locks
+    left by a crash are released on start
+    """
+
+    poll_interval = 5.0
+    window = 60.0
+
+    def __init__(
+        self,
+        handler: Handler,
+        workers: int,
+        max_attempts: int,
+        backoff: float,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.tasks: List[asyncio.Task] = []
+        self.wakeup = asyncio.Event()
+        self.in_flight = 0
+        self.completed: Deque[float] = deque()
+        self.total = 0
+
+    async def enqueue(
+        self, channel_id: int, message_id: int, attachment_ids: List[int]
+    ) -> None:
+        """Adds a message to the queue and wakes up a worker"""
+        job = IngestJobModel(
+            channel_id=str(channel_id),
+            message_id=str(message_id),
+            attachment_ids=[str(a) for a in attachment_ids],
+        )
+        await Mongo.db.save(job)
+        self.wakeup.set()
+
+    async def _claim(self) -> Optional[IngestJobModel]:
+        """Locks the oldest job that is due"""
+        jobs = Mongo.db.get_collection(IngestJobModel)
+        doc = await jobs.find_one_and_update(
+            {
+                "failed": False,
+                "locked": False,
+                "not_before": {"$lte": datetime.utcnow()},
+            },
+            {"$set": {"locked": True}, "$inc": {"attempts": 1}},
+            sort=[("not_before", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return None
+        return IngestJobModel.parse_doc(doc)
+
+    async def _retry(self, job: IngestJobModel, error: Exception) -> None:
+        """Unlocks a failed job to be retried later,
+        or marks it as failed once it runs out of attempts
+        """
+        jobs = Mongo.db.get_collection(IngestJobModel)
+        reason = f"{type(error).__name__} - {error}"
+        update = {"locked": False, "error": reason}
+        if job.attempts >= self.max_attempts:
+            update["failed"] = True
+            ingest_jobs.inc(outcome="failed")
+            print(f"Ingest of message {job.message_id} failed: {reason}")
+        else:
+            delay = self.backoff * 2 ** (job.attempts - 1)
+            ingest_jobs.inc(outcome="retry")
+            update["not_before"] = datetime.utcnow() + timedelta(
+                seconds=delay
+            )
+            print(
+                f"Ingest of message {job.message_id} failed, "
+                f"retrying in {delay:.0f}s: {reason}"
+            )
+        await jobs.update_one({"_id": job.id}, {"$set": update})
+
+    async def _process(self, job: IngestJobModel) -> None:
+        self.in_flight += 1
+        try:
+            await self.handler(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._retry(job, e)
+        else:
+            jobs = Mongo.db.get_collection(IngestJobModel)
+            await jobs.delete_one({"_id": job.id})
+            self.completed.append(time.monotonic())
+            self.total += 1
+            ingest_jobs.inc(outcome="done")
+        finally:
+            self.in_flight -= 1
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                self.wakeup.clear()
+                job = await self._claim()
+                if job is not None:
+                    await self._process(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ingest queue error: {type(e).__name__} - {e}")
+            try:
+                await asyncio.wait_for(
+                    self.wakeup.wait(), self.poll_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        """Releases jobs left locked by a previous run and starts
+        the workers, does nothing if they are already running
+        """
+        if self.tasks:
+            return
+        jobs = Mongo.db.get_collection(IngestJobModel)
+        result = await jobs.update_many(
+            {"locked": True}, {"$set": {"locked": False}}
+        )
+        if result.modified_count:
+            print(f"Recovered {result.modified_count} unfinished ingest jobs")
+        self.tasks = [
+            asyncio.ensure_future(self._work()) for _ in range(self.workers)
+        ]
+
+    def stop(self) -> None:
+        """Stops the workers, jobs in flight are picked up on next start"""
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def stats(self) -> dict:
+        """Queue depth, age of the oldest job and recent throughput"""
+        jobs = Mongo.db.get_collection(IngestJobModel)
+        now = datetime.utcnow()
+        cutoff = time.monotonic() - self.window
+        while self.completed and self.completed[0] < cutoff:
+            self.completed.popleft()
+        oldest = await jobs.find_one(
+            {"failed": False}, {"created_at": 1}, sort=[("created_at", 1)]
+        )
+        stats = {
+            "workers": len(self.tasks),
+            "in_flight": self.in_flight,
+            "ready": await jobs.count_documents(
+                {
+                    "failed": False,
+                    "locked": False,
+                    "not_before": {"$lte": now},
+                }
+            ),
+            "retrying": await jobs.count_documents(
+                {"failed": False, "not_before": {"$gt": now}}
+            ),
+            "failed": await jobs.count_documents({"failed": True}),
+            "oldest": (
+                (now - oldest["created_at"]).total_seconds()
+                if oldest is not None
+                else 0.0
+            ),
+            "per_minute": len(self.completed) * 60 / self.window,
+            "total": self.total,
+        }
+        for state in ("in_flight", "ready", "retrying", "failed"):
+            queue_depth.set(stats[state], queue=f"ingest_{state}")
+        return stats
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import List, Optional
 from odmantic import Model, Field, Reference
 
 
@@ -26,4 +27,46 @@ class ImageModel(Model):
     message_id: str
     created_at: datetime
     retrieved_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
     deleted: bool = False
+    width: Optional[int] = None
+    height: Optional[int] = None
+    sizes: List[int] = Field(default_factory=list)
+    filesize: Optional[int] = None
+    sha256: Optional[str] = None
+    phash: Optional[str] = None
+
+
+class RescanModel(Model):
+    """Checkpoint of a channel rescan in progress"""
+
+    channel: ChannelModel = Reference()
+    last_message_id: str
+    remaining: int
+    uploaded: int = 0
+    started_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class CounterModel(Model):
+    """Image counts of a channel, or of all channels under the key all"""
+
+    key: str = Field(primary_field=True)
+    active: int = 0
+    deleted: int = 0
+
+
+class IngestJobModel(Model):
+    """Message waiting to have its image attachments ingested"""
+
+    channel_id: str
+    message_id: str
+    attachment_ids: List[str]
+    attempts: int = 0
+    locked: bool = False
+    failed: bool = False
+    error: Optional[str] = None
+    not_before: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Config:
+        collection = "ingest_queue"
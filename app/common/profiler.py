@@ -0,0 +1,55 @@
+import sys
+import threading
+
+from os import path
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread from a background thread,
+    cheap enough to run on a live process. Results are in the collapsed
+    stack format read by flamegraph.pl and speedscope
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, name="profiler", daemon=True
+        )
+
+    def _sample(self) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.thread.ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = path.basename(code.co_filename)
+                stack.append(
+                    f"{code.co_name} ({filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.counts[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self) -> str:
+        """One line per distinct stack, root first, with its count"""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.counts.most_common()
+        )
@@ -0,0 +1,56 @@
+import os
+
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+
+ZEROCOPY = "http.response.zerocopy"
+
+
+class SendfileResponse(FileResponse):
+    """FileResponse that lets the server send the file with sendfile
+    when it supports the ASGI zero-copy extension, falling back to
+    reading the file in chunks otherwise
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if ZEROCOPY not in scope.get("extensions", {}):
+            await super().__call__(scope, receive, send)
+            return
+        if self.stat_result is None:
+            self.set_stat_headers(os.stat(self.path))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            with open(self.path, mode="rb") as file:
+                await send(
+                    {"type": ZEROCOPY, "file": file, "more_body": False}
+                )
+        if self.background is not None:
+            await self.background()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Checks if request's If-None-Match header matches etag"""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+
+def NotModifiedResponse(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,186 @@
+import time
+import asyncio
+import itertools
+
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class Priority(IntEnum):
+    """Lower values are sent first"""
+
+    live = 0
+    backfill = 1
+    progress = 2
+
+
+class Operation:
+    """A pending call to discord"""
+
+    def __init__(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        bucket: Hashable,
+        priority: Priority,
+        key: Optional[Hashable],
+        not_before: float,
+        sequence: int,
+    ):
+        self.factory = factory
+        self.bucket = bucket
+        self.priority = priority
+        self.key = key
+        self.not_before = not_before
+        self.sequence = sequence
+        self.future: asyncio.Future = asyncio.get_event_loop().create_future()
+        # nobody has to await an operation, errors are printed instead
+        self.future.add_done_callback(
+            lambda f: f.cancelled() or f.exception()
+        )
+
+
+class Scheduler:
+    """Sends discord requests from a few workers instead of inline,
+    so cosmetic calls don't hold up ingest. Operations in the same
+    bucket, eg. reactions in a channel, are sent one at a time in
+    order, pending operations with the same key are merged keeping
+    the latest, and delayed operations can be cancelled before they
+    are sent
+    """
+
+    def __init__(self, workers: int = 4):
+        self.pending: List[Operation] = []
+        self.keys: Dict[Hashable, Operation] = {}
+        self.busy: set = set()
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.workers = [
+            asyncio.ensure_future(self._work()) for _ in range(workers)
+        ]
+
+    def submit(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        bucket: Hashable,
+        priority: Priority = Priority.live,
+        key: Optional[Hashable] = None,
+        delay: float = 0.0,
+    ) -> asyncio.Future:
+        """Queues a call, factory creates its coroutine when it is sent.
+        A pending call with the same key is replaced by this one and
+        shares its future. Returns a future with the call's result
+        """
+        pending = self.keys.get(key) if key is not None else None
+        if pending is not None:
+            pending.factory = factory
+            return pending.future
+        operation = Operation(
+            factory,
+            bucket,
+            priority,
+            key,
+            time.monotonic() + delay,
+            next(self.sequence),
+        )
+        self.pending.append(operation)
+        if key is not None:
+            self.keys[key] = operation
+        self.wakeup.set()
+        return operation.future
+
+    def cancel(self, future: asyncio.Future) -> bool:
+        """Cancels a call that hasn't been sent yet,
+        returns False if it has already started or finished
+        """
+        for operation in self.pending:
+            if operation.future is future:
+                self._forget(operation)
+                future.cancel()
+                # operations queued behind it in its bucket may be due
+                self.wakeup.set()
+                return True
+        return False
+
+    def _forget(self, operation: Operation) -> None:
+        self.pending.remove(operation)
+        if self.keys.get(operation.key) is operation:
+            del self.keys[operation.key]
+
+    def _next(self) -> Optional[Operation]:
+        """Picks the most urgent due operation in an idle bucket,
+        the earliest submitted first within the same priority
+        """
+        now = time.monotonic()
+        blocked = set(self.busy)
+        chosen = None
+        for operation in sorted(
+            self.pending, key=lambda o: (o.priority, o.sequence)
+        ):
+            if operation.bucket in blocked:
+                continue
+            # later operations of a bucket wait for earlier ones
+            blocked.add(operation.bucket)
+            if operation.not_before <= now:
+                chosen = operation
+                break
+        return chosen
+
+    def _wait_time(self) -> Optional[float]:
+        """Seconds until the next operation in an idle bucket is due,
+        None if there is none. Operations in busy buckets are left to
+        the wakeup set when their bucket frees
+        """
+        blocked = set(self.busy)
+        due = None
+        for operation in sorted(
+            self.pending, key=lambda o: (o.priority, o.sequence)
+        ):
+            if operation.bucket in blocked:
+                continue
+            blocked.add(operation.bucket)
+            if due is None or operation.not_before < due:
+                due = operation.not_before
+        if due is None:
+            return None
+        return max(0.0, due - time.monotonic())
+
+    async def _work(self) -> None:
+        while True:
+            operation = self._next()
+            if operation is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self.wakeup.wait(), self._wait_time()
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._forget(operation)
+            self.busy.add(operation.bucket)
+            try:
+                result = await operation.factory()
+            except asyncio.CancelledError:
+                operation.future.cancel()
+                raise
+            except Exception as e:
+                print(f"Discord call failed: {type(e).__name__} - {e}")
+                operation.future.set_exception(e)
+            else:
+                operation.future.set_result(result)
+            finally:
+                self.busy.discard(operation.bucket)
+                self.wakeup.set()
+
+    def queued(self) -> int:
+        """Number of operations waiting to be sent"""
+        return len(self.pending)
+
+    def shutdown(self) -> None:
+        """Stops the workers, pending operations are dropped"""
+        for worker in self.workers:
+            worker.cancel()
+        for operation in self.pending:
+            operation.future.cancel()
+        self.pending.clear()
+        self.keys.clear()
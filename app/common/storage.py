@@ -0,0 +1,31 @@
+import hashlib
+
+from os import path
+from typing import Tuple
+
+from common.config import config
+
+
+def shard_path(filename: str) -> str:
+    """Relative path of a file in the sharded uploads layout,
+    two directory levels taken from the md5 of its name, eg. ab/cd/name
+    """
+    digest = hashlib.md5(filename.encode()).hexdigest()
+    return path.join(digest[0:2], digest[2:4], filename)
+
+
+def upload_paths(filename: str) -> Tuple[str, str]:
+    """Gets the absolute path on disk and the relative uri
+    of an uploaded file
+    """
+    sharded = shard_path(filename)
+    return (
+        path.join(config["directories"]["uploadsdir"], sharded),
+        path.join(config["directories"]["uploadsfolder"], sharded),
+    )
+
+
+def is_sharded(filepath: str) -> bool:
+    """Checks if an uploaded file's relative uri is in the sharded layout"""
+    relative = path.relpath(filepath, config["directories"]["uploadsfolder"])
+    return relative == shard_path(path.basename(filepath))
@@ -0,0 +1,259 @@
+import math
+import time
+import asyncio
+
+from os import makedirs, path
+from PIL import Image
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+
+class TranscodeResult(NamedTuple):
+    elapsed: float
+    width: int
+    height: int
+    sizes: List[int]
+    filesize: int = 0
+    phash: Optional[str] = None
+
+
+class ImageRejected(Exception):
+    """Raised when an image is over the configured size budget"""
+
+    pass
+
+
+def dhash(im: Image.Image, size: int = 8) -> str:
+    """Perceptual difference hash, compares the brightness of
+    neighbouring pixels of a size+1 by size greyscale thumbnail
+    """
+    small = im.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def derivative_path(filepath: str, size: int) -> str:
+    """Path of an image's derivative resized to size on the long edge"""
+    root, ext = path.splitext(filepath)
+    return f"{root}_{size}{ext}"
+
+
+def save_derivatives(
+    im: Image.Image, filepath: str, sizes: Sequence[int]
+) -> List[int]:
+    """Saves downsized copies of im for sizes smaller than its long edge,
+    each size is resized from the previous one, largest first
+    """
+    saved = []
+    for size in sorted(sizes, reverse=True):
+        if size >= max(im.size):
+            continue
+        im = im.copy()
+        im.thumbnail((size, size), Image.LANCZOS)
+        im.save(derivative_path(filepath, size), quality=80)
+        saved.append(size)
+    return sorted(saved)
+
+
+def draft_size(width: int, height: int, max_edge: int) -> Tuple[int, int]:
+    """Size to request from the decoder so the long edge is at least
+    max_edge while keeping the aspect ratio
+    """
+    ratio = max_edge / max(width, height)
+    return math.ceil(width * ratio), math.ceil(height * ratio)
+
+
+def transcode(
+    source: str,
+    filepath: str,
+    sizes: Sequence[int],
+    phash: bool,
+    max_pixels: int,
+    max_edge: int,
+) -> TranscodeResult:
+    """Converts image to jpg with q=80 and saves it to disk along
+    with its derivatives. Images over max_pixels are rejected from
+    their header before decoding, images with a long edge over max_edge
+    are downsampled, using reduced size decoding for jpgs.
+    Runs inside a worker process
+    """
+    start = time.perf_counter()
+    # max_pixels replaces PIL's own limit, which would raise its own
+    # error for the largest images and ignore a higher max_pixels
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        im = Image.open(source)
+    except (Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ImageRejected(str(e))
+    with im:
+        if im.width * im.height > max_pixels:
+            raise ImageRejected(
+                f"{im.width}x{im.height} is over {max_pixels} pixels"
+            )
+        oversized = max_edge and max(im.size) > max_edge
+        if oversized:
+            im.draft("RGB", draft_size(im.width, im.height, max_edge))
+        try:
+            # decode up front so corrupt or truncated files are rejected,
+            # rather than failing in convert or save
+            im.load()
+        except (OSError, SyntaxError) as e:
+            raise ImageRejected(f"image could not be decoded - {e}")
+        im_jpg = im if im.mode == "RGB" else im.convert("RGB")
+        if oversized:
+            im_jpg.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        makedirs(path.dirname(filepath), exist_ok=True)
+        im_jpg.save(filepath, quality=80)
+        saved = save_derivatives(im_jpg, filepath, sizes)
+        width, height = im_jpg.size
+        content_phash = dhash(im_jpg) if phash else None
+    return TranscodeResult(
+        time.perf_counter() - start,
+        width,
+        height,
+        saved,
+        path.getsize(filepath),
+        content_phash,
+    )
+
+
+def derive(filepath: str, sizes: Sequence[int]) -> TranscodeResult:
+    """Creates derivatives of an already stored jpg.
+    Runs inside a worker process
+    """
+    start = time.perf_counter()
+    with Image.open(filepath) as im:
+        im.load()
+        saved = save_derivatives(im, filepath, sizes)
+        width, height = im.size
+    return TranscodeResult(
+        time.perf_counter() - start,
+        width,
+        height,
+        saved,
+        path.getsize(filepath),
+    )
+
+
+class Transcoder:
+    """Process pool that decodes, encodes and writes images
+    so that the event loop is never blocked by PIL
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        sizes: Sequence[int],
+        phash: bool = False,
+        max_pixels: int = Image.MAX_IMAGE_PIXELS,
+        max_edge: int = 0,
+        history: int = 100,
+    ):
+        self.workers = workers
+        self.sizes = list(sizes)
+        self.phash = phash
+        self.max_pixels = max_pixels
+        self.max_edge = max_edge
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.pending = 0
+        self.completed = 0
+        self.timings: Deque[float] = deque(maxlen=history)
+        self.waits: Deque[float] = deque(maxlen=history)
+
+    async def _execute(
+        self, func: Callable[..., Any], *args
+    ) -> TranscodeResult:
+        """Runs a job in the current pool, replacing the pool if it has
+        broken because a worker process died, eg. killed for using too
+        much memory
+        """
+        loop = asyncio.get_event_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            if self.executor is executor:
+                print("Transcoder worker died, starting a new pool")
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                executor.shutdown(wait=False)
+            raise
+
+    async def _run(self, func: Callable[..., Any], *args) -> TranscodeResult:
+        """Runs a job in the pool and records its timings. A broken pool
+        fails every job in it, so jobs are tried once more in the new
+        pool and rejected if that breaks too
+        """
+        start = time.perf_counter()
+        self.pending += 1
+        try:
+            try:
+                result = await self._execute(func, *args)
+            except BrokenProcessPool:
+                result = await self._execute(func, *args)
+        except BrokenProcessPool:
+            raise ImageRejected("transcoder worker died processing image")
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.timings.append(result.elapsed)
+        self.waits.append(time.perf_counter() - start - result.elapsed)
+        return result
+
+    async def submit(self, source: str, filepath: str) -> TranscodeResult:
+        """Submits a job transcoding the image file at source
+        to the pool and waits for it
+        """
+        return await self._run(
+            transcode,
+            source,
+            filepath,
+            self.sizes,
+            self.phash,
+            self.max_pixels,
+            self.max_edge,
+        )
+
+    async def submit_derive(self, filepath: str) -> TranscodeResult:
+        """Submits a job creating derivatives of a stored jpg"""
+        return await self._run(derive, filepath, self.sizes)
+
+    @property
+    def queued(self) -> int:
+        """Number of jobs waiting for a free worker"""
+        return max(0, self.pending - self.workers)
+
+    def stats(self) -> dict:
+        """Summary of pool usage over the recent job history"""
+        timings = sorted(self.timings)
+        waits = list(self.waits)
+        return {
+            "workers": self.workers,
+            "active": min(self.pending, self.workers),
+            "queued": self.queued,
+            "completed": self.completed,
+            "avg": sum(timings) / len(timings) if timings else 0.0,
+            "p95": timings[int(len(timings) * 0.95)] if timings else 0.0,
+            "max": timings[-1] if timings else 0.0,
+            "wait": sum(waits) / len(waits) if waits else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        """Shuts down worker processes"""
+        self.executor.shutdown(wait=False)
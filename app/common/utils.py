@@ -1,7 +1,12 @@
+import time
+import asyncio
+
 from enum import Enum
-from typing import Optional
+from collections import OrderedDict
 from datetime import datetime
+from typing import FrozenSet, Optional, Tuple
 
+from common.config import config
 from common.database import Mongo
 from common.models import ChannelModel, ImageModel
 
@@ -20,12 +25,96 @@ def get_seed(interval: int, offset: int) -> int:
     return int(datetime.now().timestamp() / interval) - (offset * 1000)
 
 
+def get_window_end(interval: int) -> float:
+    """gets the unix timestamp at which the current seed interval ends"""
+    return (int(datetime.now().timestamp() / interval) + 1) * interval
+
+
+class ChannelCache:
+    """Caches channels by alias for ttl seconds, aliases that don't exist
+    are cached for negative_ttl seconds. At most max_entries aliases are
+    kept, least recently used first out. Entries are invalidated when
+    the channel collection is seen to change
+    """
+
+    max_entries = 10000
+
+    def __init__(self, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries: "OrderedDict[str, Tuple[float, Optional[ChannelModel]]]"
+        self.entries = OrderedDict()
+        self.snapshot: FrozenSet[Tuple[str, str]] = frozenset()
+        self.task: Optional[asyncio.Task] = None
+
+    async def get(self, alias: str) -> Optional[ChannelModel]:
+        """Gets channel based on alias, from cache if possible"""
+        now = time.monotonic()
+        entry = self.entries.get(alias)
+        if entry is not None and entry[0] > now:
+            self.entries.move_to_end(alias)
+            return entry[1]
+        channel = await Mongo.db.find_one(
+            ChannelModel, ChannelModel.alias == alias
+        )
+        ttl = self.ttl if channel is not None else self.negative_ttl
+        self.entries[alias] = (now + ttl, channel)
+        self.entries.move_to_end(alias)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return channel
+
+    def invalidate(self, alias: Optional[str] = None) -> None:
+        """Drops the cached alias, or every alias if None"""
+        if alias is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(alias, None)
+
+    async def check(self) -> None:
+        """Invalidates the cache if any channel alias has changed"""
+        channels = Mongo.db.get_collection(ChannelModel)
+        snapshot = frozenset(
+            [
+                (str(doc["_id"]), doc["alias"])
+                async for doc in channels.find({}, {"alias": 1})
+            ]
+        )
+        if snapshot != self.snapshot:
+            self.snapshot = snapshot
+            self.invalidate()
+
+    async def _check_forever(self, interval: float) -> None:
+        """Checks channels for changes every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Channel cache check failed: {type(e).__name__} - {e}")
+
+    async def start(self) -> None:
+        """Starts watching channels for changes in the background"""
+        await self.check()
+        self.task = asyncio.ensure_future(
+            self._check_forever(config["web"]["indexrefresh"])
+        )
+
+    async def stop(self) -> None:
+        """Stops watching channels"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+channel_cache = ChannelCache(
+    config["web"]["aliasttl"], config["web"]["aliasnegativettl"]
+)
+
+
 async def get_channel(alias: str) -> Optional[ChannelModel]:
     """Gets channel based on alias"""
-    channel = await Mongo.db.find_one(
-        ChannelModel, ChannelModel.alias == alias
-    )
-    return channel
+    return await channel_cache.get(alias)
 
 
 async def get_image(attachment_id: str) -> Optional[ImageModel]:
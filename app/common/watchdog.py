@@ -0,0 +1,85 @@
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+from typing import Optional
+
+from common.metrics import registry
+
+loop_lag = registry.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop wakes up from a short sleep",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+loop_stalls = registry.counter(
+    "event_loop_stalls_total", "Times the event loop was blocked too long"
+)
+
+
+class Watchdog:
+    """Measures event loop lag with a heartbeat task. A thread watches
+    the heartbeat and prints the loop thread's stack when it stops
+    for longer than threshold seconds, showing what is blocking it
+    """
+
+    interval = 0.1
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.beat = time.monotonic()
+        self.reported = 0.0
+        self.loop_thread: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopped = threading.Event()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.beat = time.monotonic()
+            lag = self.beat - start - self.interval
+            loop_lag.observe(lag)
+            if lag >= self.threshold:
+                print(f"Event loop was blocked for {lag:.3f}s")
+
+    def _watch(self, stopped: threading.Event) -> None:
+        while not stopped.wait(self.threshold / 2):
+            beat = self.beat
+            if time.monotonic() - beat < self.threshold + self.interval:
+                continue
+            if beat == self.reported:
+                continue
+            # report each stall once, at the first check past threshold
+            self.reported = beat
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            print(
+                f"Event loop blocked for over {self.threshold}s, "
+                f"in:\n{stack}",
+                file=sys.stderr,
+            )
+
+    def start(self) -> None:
+        """Starts watching the running loop, called from the loop"""
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.stopped = threading.Event()
+        self.task = asyncio.ensure_future(self._heartbeat())
+        threading.Thread(
+            target=self._watch,
+            args=(self.stopped,),
+            name="watchdog",
+            daemon=True,
+        ).start()
+
+    def stop(self) -> None:
+        """Stops the heartbeat and the watching thread"""
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,79 @@
+import asyncio
+import argparse
+
+from os import path
+from datetime import datetime
+
+from common.config import config
+from common.database import Mongo
+from common.models import ImageModel
+from common.transcode import Transcoder
+
+
+async def backfill(force: bool = False) -> None:
+    """Creates derivatives for stored images that don't have them yet,
+    or for every image if force is set
+    """
+    transcoder = Transcoder(
+        config["transcoder"]["workers"], config["transcoder"]["sizes"]
+    )
+    images = Mongo.db.get_collection(ImageModel)
+    query = {} if force else {"width": None}
+    total = await images.count_documents(query)
+    limit = asyncio.Semaphore(transcoder.workers * 2)
+    done = 0
+    failed = 0
+
+    async def process(doc: dict) -> None:
+        nonlocal done, failed
+        try:
+            result = await transcoder.submit_derive(
+                path.join(config["directories"]["staticdir"], doc["filepath"])
+            )
+        except Exception as e:
+            failed += 1
+            print(f"Failed {doc['attachment_id']}: {type(e).__name__} - {e}")
+        else:
+            await images.update_one(
+                {"_id": doc["_id"]},
+                {
+                    "$set": {
+                        "width": result.width,
+                        "height": result.height,
+                        "sizes": result.sizes,
+                        "updated_at": datetime.utcnow(),
+                    }
+                },
+            )
+            done += 1
+            if done % 100 == 0:
+                print(f"Progress {done}/{total}")
+        finally:
+            limit.release()
+
+    tasks = set()
+    async for doc in images.find(query, {"attachment_id": 1, "filepath": 1}):
+        await limit.acquire()
+        task = asyncio.ensure_future(process(doc))
+        task.add_done_callback(tasks.discard)
+        tasks.add(task)
+    await asyncio.gather(*tasks)
+    transcoder.shutdown()
+    print(f"Created derivatives for {done} images, {failed} failed")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Create resized derivatives of stored images"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="recreate derivatives for every image, eg. after changing sizes",
+    )
+    args = parser.parse_args()
+    Mongo.connect()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(backfill(args.force))
+    Mongo.close()
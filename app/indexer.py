@@ -0,0 +1,47 @@
+import asyncio
+import argparse
+
+from common.config import config
+from common.database import Mongo
+from common.index import ImageIndex, write_index
+
+
+async def publish(filename: str, interval: float) -> None:
+    """Keeps an in-memory index fresh and writes it to filename
+    whenever it changes, for web workers running with IndexMode = mmap
+    """
+    loop = asyncio.get_event_loop()
+    index = ImageIndex()
+    await index.load()
+    written = None
+    while True:
+        if index.generation != written:
+            # the index isn't refreshed while the file is being written
+            await loop.run_in_executor(
+                None, write_index, filename, index.all, index.channels
+            )
+            written = index.generation
+            print(f"Published {index.count()} images to {filename}")
+        await asyncio.sleep(interval)
+        try:
+            await index.refresh()
+        except Exception as e:
+            print(f"Image index refresh failed: {type(e).__name__} - {e}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Publish the image index file shared by web workers"
+    )
+    parser.add_argument("--file", default=config["web"]["indexfile"])
+    parser.add_argument(
+        "--interval", type=float, default=config["web"]["indexrefresh"]
+    )
+    args = parser.parse_args()
+    Mongo.connect()
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(publish(args.file, args.interval))
+    finally:
+        Mongo.close()
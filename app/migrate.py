@@ -1,28 +1,229 @@
+import sys
 import asyncio
+import argparse
 
-from motor.motor_asyncio import AsyncIOMotorClient
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
 from common.config import config
+from common.database import database_uri
+from routes.api import random_images_pipeline
 
-motor = AsyncIOMotorClient(
-    "mongodb://{username}:{password}@{host}:{port}/{database}".format(
-        **config["database"]
-    )
-)
-db = motor[config["database"]["database"]]
+Migration = Tuple[
+    int, str, Callable[[AsyncIOMotorDatabase], Awaitable[None]]
+]
+migrations: List[Migration] = []
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migration(version: int, description: str):
+    """Registers a migration, versions are applied in ascending order
+    and each is only ever applied once
+    """
+
+    def register(func: Callable[[AsyncIOMotorDatabase], Awaitable[None]]):
+        migrations.append((version, description, func))
+        return func
 
+    return register
 
-async def setup_collections():
+
+@migration(1, "single field indexes")
+async def setup_collections(db: AsyncIOMotorDatabase):
     await db.image.create_index("created_at")
     await db.image.create_index("channel")
     await db.image.create_index("attachment_id")
     await db.image.create_index("deleted")
+    await db.image.create_index("updated_at")
     await db.channel.create_index("alias")
 
 
+@migration(2, "compound indexes for route queries")
+async def compound_indexes(db: AsyncIOMotorDatabase):
+    await db.image.create_index(
+        [("deleted", 1), ("channel", 1), ("attachment_id", 1)]
+    )
+    await db.image.create_index(
+        [("deleted", 1), ("channel", 1), ("created_at", 1)]
+    )
+    await db.image.create_index([("deleted", 1), ("attachment_id", 1)])
+    await db.image.create_index([("channel", 1), ("attachment_id", 1)])
+
+
+@migration(3, "unique attachment ids")
+async def unique_attachment_id(db: AsyncIOMotorDatabase):
+    duplicates = await db.image.aggregate(
+        [
+            {"$group": {"_id": "$attachment_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$limit": 10},
+        ]
+    ).to_list(length=10)
+    if duplicates:
+        ids = ", ".join(doc["_id"] for doc in duplicates)
+        raise MigrationError(f"duplicate attachment ids found: {ids}")
+    indexes = await db.image.index_information()
+    if not indexes.get("attachment_id_1", {}).get("unique", False):
+        if "attachment_id_1" in indexes:
+            await db.image.drop_index("attachment_id_1")
+        await db.image.create_index("attachment_id", unique=True)
+
+
+@migration(4, "content hash indexes")
+async def content_hash_indexes(db: AsyncIOMotorDatabase):
+    await db.image.create_index("sha256")
+    await db.image.create_index("phash")
+
+
+@migration(5, "ingest queue indexes")
+async def ingest_queue_indexes(db: AsyncIOMotorDatabase):
+    await db.ingest_queue.create_index(
+        [("failed", 1), ("locked", 1), ("not_before", 1)]
+    )
+    await db.ingest_queue.create_index([("failed", 1), ("created_at", 1)])
+
+
+async def migrate(db: AsyncIOMotorDatabase) -> None:
+    """Applies migrations that haven't been recorded as applied yet"""
+    applied = {doc["_id"] async for doc in db.migration.find({}, {"_id": 1})}
+    for version, description, func in sorted(migrations, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        print(f"Applying migration {version}: {description}")
+        await func(db)
+        await db.migration.insert_one(
+            {
+                "_id": version,
+                "description": description,
+                "applied_at": datetime.utcnow(),
+            }
+        )
+
+
+def route_queries() -> List[Tuple[str, Dict[str, Any]]]:
+    """Query shapes used by routes/api.py and the image index,
+    as explainable commands on the image and channel collections
+    """
+    channel = ObjectId()
+    sort = {"attachment_id": -1}
+    queries = [
+        (
+            "api image by id",
+            {"find": "image", "filter": {"attachment_id": "0"}},
+        ),
+        ("api channel by alias", {"find": "channel", "filter": {"alias": ""}}),
+        (
+            "index refresh",
+            {
+                "find": "image",
+                "filter": {"updated_at": {"$gte": datetime.utcnow()}},
+            },
+        ),
+    ]
+    filters = [
+        {},
+        {"channel": channel},
+        {"deleted": False},
+        {"deleted": False, "channel": channel},
+    ]
+    for match in filters:
+        name = ", ".join(match) or "no filters"
+        queries.append(
+            (
+                f"api images ({name})",
+                {"find": "image", "filter": match, "sort": sort},
+            )
+        )
+        # pages after the first filter past the cursor's attachment id
+        for order, operator, direction in (
+            ("desc", "$lt", -1),
+            ("asc", "$gt", 1),
+        ):
+            queries.append(
+                (
+                    f"api images {order} cursor ({name})",
+                    {
+                        "find": "image",
+                        "filter": {**match, "attachment_id": {operator: "0"}},
+                        "sort": {"attachment_id": direction},
+                    },
+                )
+            )
+        if match:
+            queries.append(
+                (f"api count ({name})", {"count": "image", "query": match})
+            )
+            # without a match $sample reads random documents directly,
+            # only a filtered sample depends on an index
+            queries.append(
+                (
+                    f"api randomimage ({name})",
+                    {
+                        "aggregate": "image",
+                        "pipeline": random_images_pipeline(match, 100),
+                        "cursor": {},
+                    },
+                )
+            )
+    return queries
+
+
+def plan_stages(explain: Any) -> List[str]:
+    """Collects the stages of winning plans in an explain output"""
+    stages = []
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key in ("rejectedPlans", "allPlansExecution"):
+                continue
+            if key == "stage" and isinstance(value, str):
+                stages.append(value)
+            else:
+                stages.extend(plan_stages(value))
+    elif isinstance(explain, list):
+        for value in explain:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+async def check_queries(db: AsyncIOMotorDatabase) -> bool:
+    """Explains every route query, failing any that would need
+    a collection scan or an in-memory sort
+    """
+    ok = True
+    for name, command in route_queries():
+        explain = await db.command(
+            {"explain": command, "verbosity": "queryPlanner"}
+        )
+        stages = plan_stages(explain)
+        bad = [s for s in stages if s in ("COLLSCAN", "SORT")]
+        if bad:
+            ok = False
+        print(f"{'FAIL' if bad else 'ok':4} {name}: {' > '.join(stages)}")
+    return ok
+
+
 if __name__ == "__main__":
 
-    print("Setting up indexes for database")
+    parser = argparse.ArgumentParser(description="Discord2VRC migrations")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="explain route queries and fail on collection scans or sorts",
+    )
+    args = parser.parse_args()
+    motor = AsyncIOMotorClient(database_uri())
+    db = motor[config["database"]["database"]]
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(setup_collections())
-    print("done!")
+    if args.check:
+        if not loop.run_until_complete(check_queries(db)):
+            sys.exit(1)
+    else:
+        print("Setting up indexes for database")
+        loop.run_until_complete(migrate(db))
+        print("done!")
@@ -0,0 +1,130 @@
+import os
+import re
+import errno
+import shutil
+import asyncio
+import argparse
+
+from os import path
+from datetime import datetime
+from typing import List, Tuple
+
+from pymongo import UpdateMany
+
+from common.config import config
+from common.database import Mongo
+from common.models import ImageModel
+from common.storage import is_sharded, shard_path
+from common.transcode import derivative_path
+
+
+def absolute(filepath: str) -> str:
+    """Absolute path on disk of a relative uri"""
+    return path.join(config["directories"]["staticdir"], filepath)
+
+
+def link(src: str, dst: str) -> None:
+    """Hard links src to dst, copying if it's on another filesystem"""
+    os.makedirs(path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(src, dst)
+
+
+def files_of(filepath: str, sizes: List[int]) -> List[str]:
+    """Relative uris of an image's file and its derivatives"""
+    return [filepath] + [derivative_path(filepath, size) for size in sizes]
+
+
+async def reshard_pass(batch_size: int, grace: float) -> int:
+    """Moves every file in the flat layout to the sharded layout,
+    returns the number of files moved. Files are linked into place
+    before documents are updated and only removed after a grace period,
+    so the web server and bot can keep using either path meanwhile
+    """
+    images = Mongo.db.get_collection(ImageModel)
+    folder = re.escape(config["directories"]["uploadsfolder"])
+    query = {"filepath": {"$regex": f"^{folder}/[^/]+$"}}
+    seen = set()
+    batch: List[Tuple[str, str, List[str]]] = []
+    moved = 0
+
+    async def flush() -> None:
+        nonlocal moved
+        if not batch:
+            return
+        now = datetime.utcnow()
+        await images.bulk_write(
+            [
+                UpdateMany(
+                    {"filepath": old},
+                    {"$set": {"filepath": new, "updated_at": now}},
+                )
+                for old, new, _ in batch
+            ],
+            ordered=False,
+        )
+        await asyncio.sleep(grace)
+        for old, _, old_files in batch:
+            for old_file in old_files:
+                try:
+                    os.unlink(absolute(old_file))
+                except FileNotFoundError:
+                    pass
+        moved += len(batch)
+        print(f"Moved {moved} files")
+        batch.clear()
+
+    async for doc in images.find(query, {"filepath": 1, "sizes": 1}):
+        old = doc["filepath"]
+        if old in seen or is_sharded(old):
+            continue
+        seen.add(old)
+        new = path.join(
+            config["directories"]["uploadsfolder"],
+            shard_path(path.basename(old)),
+        )
+        old_files = files_of(old, doc.get("sizes") or [])
+        for old_file, new_file in zip(
+            old_files, files_of(new, doc.get("sizes") or [])
+        ):
+            if path.exists(absolute(old_file)):
+                link(absolute(old_file), absolute(new_file))
+        batch.append((old, new, old_files))
+        if len(batch) >= batch_size:
+            await flush()
+    await flush()
+    return moved
+
+
+async def reshard(batch_size: int, grace: float) -> None:
+    """Repeats passes until no documents point at the flat layout,
+    picking up any that were written while a pass was running
+    """
+    while await reshard_pass(batch_size, grace) > 0:
+        pass
+    print("All files are in the sharded layout")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Move uploads from the flat layout into shards"
+    )
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument(
+        "--grace",
+        type=float,
+        default=config["web"]["indexrefresh"] * 2,
+        help="seconds to keep old files after updating their documents",
+    )
+    args = parser.parse_args()
+    Mongo.connect()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(reshard(args.batch, args.grace))
+    Mongo.close()
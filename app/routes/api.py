@@ -1,10 +1,14 @@
+import base64
+import binascii
+
 from typing import List, Optional
 
 from pydantic import BaseModel
 from bson.objectid import ObjectId
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Response
 from fastapi.responses import JSONResponse
 
+from common.counters import get_count
 from common.database import Mongo
 from common.utils import Order, get_channel, get_image
 from common.models import ChannelModel, ImageModel
@@ -22,22 +26,59 @@ def NotFoundResponse(message: str = "Not found"):
     return JSONResponse(content=response.dict(), status_code=404)
 
 
+class BadRequestError(BaseModel):
+    error: str = "Bad request"
+
+
+def BadRequestResponse(message: str = "Bad request"):
+    response = BadRequestError(error=message)
+    return JSONResponse(content=response.dict(), status_code=400)
+
+
+def encode_cursor(attachment_id: str) -> str:
+    """Encodes the last attachment id of a page into an opaque cursor"""
+    return base64.urlsafe_b64encode(attachment_id.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[str]:
+    """Decodes a cursor back into an attachment id, None if invalid"""
+    try:
+        attachment_id = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if not attachment_id.isdigit():
+        return None
+    return attachment_id
+
+
 @router.get(
     "/image",
     response_model=List[ImageModel],
-    responses={404: {"model": NotFoundError}},
+    responses={404: {"model": NotFoundError}, 400: {"model": BadRequestError}},
 )
 async def get_images(
+    response: Response,
     alias: Optional[str] = None,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=0),
     order: Order = Order.desc,
     deleted: Optional[bool] = None,
+    cursor: Optional[str] = None,
 ):
     """Retrieves image documents, if alias is not provided
     will retrieve all images.
+    For paging through many images pass the X-Next-Cursor header
+    of the previous page as cursor, instead of increasing skip
     """
     queries: List = []
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if after is None:
+            return BadRequestResponse(f'cursor "{cursor}" is not valid')
+        if order == Order.desc:
+            queries.append(ImageModel.attachment_id < after)
+        else:
+            queries.append(ImageModel.attachment_id > after)
     options = {
         "sort": getattr(ImageModel.attachment_id, order.value)(),
         "skip": skip,
@@ -52,22 +93,19 @@ async def get_images(
         queries.append(ImageModel.deleted == deleted)
     images = await Mongo.db.find(ImageModel, *queries, **options)
     if images:
+        if len(images) == limit:
+            next_cursor = encode_cursor(images[-1].attachment_id)
+            response.headers["X-Next-Cursor"] = next_cursor
         return images
     return NotFoundResponse("No items found")
 
 
-@router.get(
-    "/randomimage",
-    response_model=List[ImageModel],
-    responses={404: {"model": NotFoundError}},
-)
-async def get_random_images(
-    alias: Optional[str] = None,
-    limit: int = Query(100, ge=0),
-    deleted: Optional[bool] = None,
-):
-    """Retrieves randomized list of image documents"""
+def random_images_pipeline(match: dict, limit: int) -> List[dict]:
+    """Aggregation that samples images before joining their channel,
+    so only the sampled documents are looked up
+    """
     pipeline = [
+        {"$sample": {"size": limit}},
         {
             "$lookup": {
                 "from": "channel",
@@ -77,8 +115,23 @@ async def get_random_images(
             }
         },
         {"$unwind": {"path": "$channel"}},
-        {"$sample": {"size": limit}},
     ]
+    if match:
+        pipeline.insert(0, {"$match": match})
+    return pipeline
+
+
+@router.get(
+    "/randomimage",
+    response_model=List[ImageModel],
+    responses={404: {"model": NotFoundError}},
+)
+async def get_random_images(
+    alias: Optional[str] = None,
+    limit: int = Query(100, ge=0),
+    deleted: Optional[bool] = None,
+):
+    """Retrieves randomized list of image documents"""
     match = []
     if alias is not None:
         channel = await get_channel(alias)
@@ -89,8 +142,7 @@ async def get_random_images(
         match.append(("deleted", deleted))
 
     images = Mongo.db.get_collection(ImageModel)
-    if match:
-        pipeline.insert(0, {"$match": {k: v for k, v in match}})
+    pipeline = random_images_pipeline({k: v for k, v in match}, limit)
     result = await images.aggregate(pipeline).to_list(length=limit)
     if result:
         return [ImageModel.parse_doc(doc) for doc in result]
@@ -150,12 +202,9 @@ async def get_image_count(
     """Counts number of images, if alias is not provided
     will count all images
     """
-    queries: List = []
-    if alias is not None:
-        channel = await get_channel(alias)
-        if channel is None:
-            return NotFoundResponse(f'alias "{alias}" does not exist')
-        queries.append(ImageModel.channel == channel.id)
-    if deleted is not None:
-        queries.append(ImageModel.deleted == deleted)
-    return await Mongo.db.count(ImageModel, *queries)
+    if alias is None:
+        return await get_count(deleted=deleted)
+    channel = await get_channel(alias)
+    if channel is None:
+        return NotFoundResponse(f'alias "{alias}" does not exist')
+    return await get_count(channel.id, deleted)
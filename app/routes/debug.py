@@ -0,0 +1,95 @@
+import hmac
+import asyncio
+
+from typing import Optional
+
+from fastapi import APIRouter, Query, Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from common.config import config
+from common.profiler import SamplingProfiler
+
+router = APIRouter()
+
+
+class ProfileSession:
+    """Counts down requests finished while a profile is running"""
+
+    def __init__(self, requests: int):
+        self.remaining = requests
+        self.done = asyncio.Event()
+
+    def finished(self) -> None:
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.done.set()
+
+
+session: Optional[ProfileSession] = None
+
+
+class ProfileMiddleware:
+    """Tells the running profile session about finished requests,
+    does nothing else while no profile is running
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        current = session
+        if current is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current.finished()
+
+
+def authorized(request: Request) -> bool:
+    """Checks the bearer token against ProfileToken under [Web],
+    profiling is disabled if it isn't set
+    """
+    token = config["web"]["profiletoken"]
+    if token is None:
+        return False
+    given = request.headers.get("authorization", "")
+    return hmac.compare_digest(given.encode(), f"Bearer {token}".encode())
+
+
+@router.get("/debug/profile", include_in_schema=False)
+async def profile(
+    request: Request,
+    requests: int = Query(100, ge=1, le=100000),
+    timeout: float = Query(60, gt=0, le=600),
+):
+    """Profiles this worker until it has handled the next requests,
+    or until timeout seconds have passed, and returns the stacks
+    for flamegraph.pl or speedscope
+    """
+    global session
+    if not authorized(request):
+        return Response(status_code=404)
+    if session is not None:
+        return PlainTextResponse("already profiling", status_code=409)
+    session = ProfileSession(requests)
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        await asyncio.wait_for(session.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        profiler.stop()
+        handled = requests - max(0, session.remaining)
+        session = None
+    return PlainTextResponse(
+        profiler.collapsed(),
+        headers={
+            "Content-Disposition": 'attachment; filename="web.folded"',
+            "X-Profiled-Requests": str(handled),
+            "X-Profile-Samples": str(profiler.samples),
+        },
+    )
@@ -0,0 +1,67 @@
+import time
+
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from common.metrics import registry
+
+router = APIRouter()
+
+request_seconds = registry.histogram(
+    "http_request_seconds",
+    "Web request latency by handler, status and result",
+    ("handler", "method", "status", "result"),
+)
+
+
+class RecordMiddleware:
+    """Times every request as a plain ASGI middleware, so responses
+    like sendfile pass through untouched. Handlers can describe how
+    they answered by setting request.state.result, eg. placeholder
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        # request.state reads and writes this dict
+        state = scope.setdefault("state", {})
+        state["result"] = ""
+        status = 500
+
+        async def send_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            endpoint = scope.get("endpoint")
+            if endpoint is None:
+                handler = "unmatched"
+            else:
+                handler = getattr(
+                    endpoint, "__name__", type(endpoint).__name__
+                )
+            request_seconds.observe(
+                time.perf_counter() - started,
+                handler=handler,
+                method=scope["method"],
+                status=str(status),
+                result=state.get("result", ""),
+            )
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
+    )
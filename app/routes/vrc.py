@@ -1,15 +1,27 @@
+import os
+import math
+import time
 import random
 from os import path
+from typing import Optional, Tuple
 
-from bson.objectid import ObjectId
-from fastapi import APIRouter, Query, Path
+from fastapi import APIRouter, Query, Path, Request
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import RedirectResponse, Response
 
-from common.database import Mongo
-from common.models import ImageModel
-from common.utils import Order, get_channel, get_seed
+from common.cache import WindowCache
+from common.config import config
+from common.index import IndexEntry, image_index
+from common.responses import (
+    NotModifiedResponse,
+    SendfileResponse,
+    etag_matches,
+)
+from common.transcode import derivative_path
+from common.utils import Order, get_channel, get_seed, get_window_end
 
 router = APIRouter(default_response_class=Response)
+randomsync_cache = WindowCache()
 
 
 def RedirectPlaceholder() -> RedirectResponse:
@@ -20,134 +32,243 @@ def RedirectImage(filepath: str) -> RedirectResponse:
     return RedirectResponse(url=path.join("/", filepath))
 
 
+async def placeholder_response(request: Request) -> Response:
+    """Redirects to the placeholder, or serves it directly
+    if ServeDirect is enabled
+    """
+    request.state.result = "placeholder"
+    if not config["web"]["servedirect"]:
+        return RedirectPlaceholder()
+    filepath = path.join(config["directories"]["staticdir"], "placeholder.png")
+    try:
+        stat_result = await run_in_threadpool(os.stat, filepath)
+    except FileNotFoundError:
+        return RedirectPlaceholder()
+    return SendfileResponse(
+        filepath,
+        headers={"Cache-Control": "no-cache"},
+        stat_result=stat_result,
+        method=request.method,
+    )
+
+
+def pick_size(
+    image: IndexEntry, size: Optional[int]
+) -> Tuple[str, Optional[int]]:
+    """Picks the stored file closest to size on its long edge,
+    returns the filepath and the derivative size, None if original
+    """
+    if size is None or not image.sizes:
+        return image.filepath, None
+    candidates = list(image.sizes)
+    if image.long_edge:
+        candidates.append(image.long_edge)
+    closest = min(candidates, key=lambda c: abs(c - size))
+    if closest not in image.sizes:
+        return image.filepath, None
+    return derivative_path(image.filepath, closest), closest
+
+
+async def image_response(
+    request: Request,
+    image: IndexEntry,
+    max_age: Optional[int],
+    size: Optional[int] = None,
+) -> Response:
+    """Redirects to the image, or serves it directly if ServeDirect
+    is enabled. The ETag is the attachment id as stored images never
+    change, max_age of None marks the response as uncacheable.
+    size picks the closest derivative to that many px on the long edge
+    """
+    filepath, derivative = pick_size(image, size)
+    if not config["web"]["servedirect"]:
+        request.state.result = "redirect"
+        return RedirectImage(filepath)
+    if derivative is None:
+        etag = f'"{image.attachment_id}"'
+    else:
+        etag = f'"{image.attachment_id}-{derivative}"'
+    if max_age is None:
+        cache_control = "no-store"
+    else:
+        cache_control = f"public, max-age={max_age}"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        request.state.result = "not_modified"
+        return NotModifiedResponse(headers)
+    filepath = path.join(config["directories"]["staticdir"], filepath)
+    try:
+        stat_result = await run_in_threadpool(os.stat, filepath)
+    except FileNotFoundError:
+        return await placeholder_response(request)
+    request.state.result = "image"
+    return SendfileResponse(
+        filepath,
+        headers=headers,
+        media_type="image/jpeg",
+        stat_result=stat_result,
+        method=request.method,
+    )
+
+
+def ordered_max_age(order: Order) -> int:
+    """Images at an index only shift in descending order when new
+    images are added, so ascending order can be cached for longer
+    """
+    if order == Order.asc:
+        return config["web"]["orderedmaxage"]
+    return config["web"]["latestmaxage"]
+
+
+def window_max_age(interval: int) -> int:
+    """Seconds left in the current randomsync interval"""
+    return max(0, math.ceil(get_window_end(interval) - time.time()))
+
+
+def random_entry(channel_id: Optional[str] = None) -> Optional[IndexEntry]:
+    """Picks a random image from the index"""
+    count = image_index.count(channel_id)
+    if count > 0:
+        return image_index.get(random.randrange(count), Order.asc, channel_id)
+    return None
+
+
+def seeded_entry(
+    seed: int, channel_id: Optional[str] = None
+) -> Optional[IndexEntry]:
+    """Picks a random image from the index with a seeded rng,
+    counting from the newest image
+    """
+    count = image_index.count(channel_id)
+    if count > 0:
+        num = random.Random(seed).randint(0, count - 1)
+        return image_index.get(num, Order.desc, channel_id)
+    return None
+
+
 @router.get("/all/image/{index}")
 async def all_ordered(
+    request: Request,
     index: int = Path(..., ge=0),
     order: Order = Order.desc,
+    size: Optional[int] = Query(None, ge=1),
 ):
     """Returns the image based on the index provided and order specified.
     Defaults to decending order
     """
-    images = await Mongo.db.find(
-        ImageModel,
-        ImageModel.deleted == False,
-        sort=getattr(ImageModel.attachment_id, order.value)(),
-        skip=index,
-        limit=1,
-    )
-    if images:
-        return RedirectImage(images[0].filepath)
-    return RedirectPlaceholder()
+    entry = image_index.get(index, order)
+    if entry is not None:
+        return await image_response(
+            request, entry, ordered_max_age(order), size
+        )
+    return await placeholder_response(request)
 
 
 @router.get("/all/random")
-async def all_random_image():
+async def all_random_image(
+    request: Request, size: Optional[int] = Query(None, ge=1)
+):
     """Returns a random image"""
-    images = Mongo.db.get_collection(ImageModel)
-    result = await images.aggregate(
-        [{"$match": {"deleted": False}}, {"$sample": {"size": 1}}]
-    ).to_list(length=1)
-    if result:
-        return RedirectImage(result[0]["filepath"])
-    return RedirectPlaceholder()
+    entry = random_entry()
+    if entry is not None:
+        return await image_response(request, entry, None, size)
+    return await placeholder_response(request)
 
 
 @router.get("/all/randomsync")
 async def all_random_sync(
+    request: Request,
     interval: int = Query(5, ge=5),
     offset: int = 0,
+    size: Optional[int] = Query(None, ge=1),
 ):
     """Returns a random image that is pseudo synced for all requests
     based on interval and offset for a seeded rng
     """
-    count = await Mongo.db.count(ImageModel, ImageModel.deleted == False)
-    if count > 0:
-        random.seed(get_seed(interval, offset))
-        num = random.randint(0, count - 1)
-        images = await Mongo.db.find(
-            ImageModel,
-            ImageModel.deleted == False,
-            sort=ImageModel.attachment_id.desc(),  # type: ignore[attr-defined]
-            skip=num,
-            limit=1,
+    seed = get_seed(interval, offset)
+    entry = await randomsync_cache.get(
+        (None, interval, offset, seed),
+        get_window_end(interval),
+        lambda: _all_random_sync(seed),
+    )
+    if entry is not None:
+        return await image_response(
+            request, entry, window_max_age(interval), size
         )
-        return RedirectImage(images[0].filepath)
-    return RedirectPlaceholder()
+    return await placeholder_response(request)
+
+
+async def _all_random_sync(seed: int) -> Optional[IndexEntry]:
+    """Picks a random image with a seeded rng"""
+    return seeded_entry(seed)
 
 
 @router.get("/channel/{alias}/image/{index}")
 async def channel_ordered(
+    request: Request,
     alias: str,
     index: int = Path(..., ge=0),
     order: Order = Order.desc,
+    size: Optional[int] = Query(None, ge=1),
 ):
     """Returns the image based on the index provided and order specified,
     and Channel alias. Defaults to decending order
     """
     channel = await get_channel(alias)
     if channel is not None:
-        images = await Mongo.db.find(
-            ImageModel,
-            ImageModel.deleted == False,
-            ImageModel.channel == channel.id,
-            sort=getattr(ImageModel.attachment_id, order.value)(),
-            skip=index,
-            limit=1,
-        )
-        if images:
-            return RedirectImage(images[0].filepath)
-    return RedirectPlaceholder()
+        entry = image_index.get(index, order, channel.id)
+        if entry is not None:
+            return await image_response(
+                request, entry, ordered_max_age(order), size
+            )
+    return await placeholder_response(request)
 
 
 @router.get("/channel/{alias}/random")
-async def channel_random_image(alias: str):
+async def channel_random_image(
+    request: Request, alias: str, size: Optional[int] = Query(None, ge=1)
+):
     """Returns a random image from specified channel alias."""
     channel = await get_channel(alias)
     if channel is not None:
-        images = Mongo.db.get_collection(ImageModel)
-        result = await images.aggregate(
-            [
-                {
-                    "$match": {
-                        "channel": ObjectId(channel.id),
-                        "deleted": False,
-                    }
-                },
-                {"$sample": {"size": 1}},
-            ]
-        ).to_list(length=1)
-        if result:
-            return RedirectImage(result[0]["filepath"])
-    return RedirectPlaceholder()
+        entry = random_entry(channel.id)
+        if entry is not None:
+            return await image_response(request, entry, None, size)
+    return await placeholder_response(request)
 
 
 @router.get("/channel/{alias}/randomsync")
 async def channel_random_sync(
+    request: Request,
     alias: str,
     interval: int = Query(5, ge=5),
     offset: int = 0,
+    size: Optional[int] = Query(None, ge=1),
 ):
     """Returns a random image that is pseudo synced for all requests
     based on interval and offset for a seeded rng,
     from the specified channel alias
     """
+    seed = get_seed(interval, offset)
+    entry = await randomsync_cache.get(
+        (alias, interval, offset, seed),
+        get_window_end(interval),
+        lambda: _channel_random_sync(alias, seed),
+    )
+    if entry is not None:
+        return await image_response(
+            request, entry, window_max_age(interval), size
+        )
+    return await placeholder_response(request)
+
+
+async def _channel_random_sync(
+    alias: str, seed: int
+) -> Optional[IndexEntry]:
+    """Picks a random image from the specified channel alias
+    with a seeded rng
+    """
     channel = await get_channel(alias)
     if channel is not None:
-        count = await Mongo.db.count(
-            ImageModel,
-            ImageModel.deleted == False,
-            ImageModel.channel == channel.id,
-        )
-        if count > 0:
-            random.seed(get_seed(interval, offset))
-            num = random.randint(0, count - 1)
-            images = await Mongo.db.find(
-                ImageModel,
-                ImageModel.deleted == False,
-                ImageModel.channel == channel.id,
-                sort=ImageModel.created_at.desc(),  # type: ignore[attr-defined]
-                skip=num,
-                limit=1,
-            )
-            return RedirectImage(images[0].filepath)
-    return RedirectPlaceholder()
+        return seeded_entry(seed, channel.id)
+    return None
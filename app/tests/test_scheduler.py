@@ -0,0 +1,103 @@
+import time
+import asyncio
+import unittest
+
+from common.scheduler import Priority, Scheduler
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(coroutine)
+        # let the cancelled workers finish before closing the loop
+        loop.run_until_complete(asyncio.sleep(0))
+        return result
+    finally:
+        loop.close()
+
+
+class CountingScheduler(Scheduler):
+    """Counts how often workers look for the next operation"""
+
+    def __init__(self, workers: int = 4):
+        self.picks = 0
+        super().__init__(workers)
+
+    def _next(self):
+        self.picks += 1
+        return super()._next()
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_busy_bucket_does_not_spin(self):
+        async def test():
+            scheduler = CountingScheduler()
+            started = []
+
+            async def call(i):
+                started.append(i)
+                await asyncio.sleep(0.1)
+
+            futures = [
+                scheduler.submit(lambda i=i: call(i), "bucket")
+                for i in range(4)
+            ]
+            start = time.monotonic()
+            await asyncio.gather(*futures)
+            elapsed = time.monotonic() - start
+            scheduler.shutdown()
+            return started, elapsed, scheduler.picks
+
+        started, elapsed, picks = run(test())
+        self.assertEqual(started, [0, 1, 2, 3])
+        self.assertGreaterEqual(elapsed, 0.4)
+        # idle workers sleep until the bucket frees instead of polling
+        self.assertLess(picks, 50)
+
+    def test_cancel_wakes_operations_behind_it(self):
+        async def test():
+            scheduler = Scheduler(workers=1)
+            delayed = scheduler.submit(
+                lambda: asyncio.sleep(0), "bucket", delay=10
+            )
+            after = scheduler.submit(
+                lambda: asyncio.sleep(0, "sent"), "bucket"
+            )
+            await asyncio.sleep(0.05)
+            self.assertTrue(scheduler.cancel(delayed))
+            result = await asyncio.wait_for(after, 1)
+            scheduler.shutdown()
+            return result
+
+        self.assertEqual(run(test()), "sent")
+
+    def test_priority_order(self):
+        async def test():
+            scheduler = Scheduler(workers=1)
+            sent = []
+
+            async def call(name):
+                sent.append(name)
+
+            blocker = scheduler.submit(
+                lambda: asyncio.sleep(0.05), "bucket"
+            )
+            await asyncio.sleep(0)
+            futures = [
+                scheduler.submit(
+                    lambda: call("progress"), "other", Priority.progress
+                ),
+                scheduler.submit(
+                    lambda: call("backfill"), "other", Priority.backfill
+                ),
+                scheduler.submit(lambda: call("live"), "other"),
+            ]
+            await asyncio.gather(blocker, *futures)
+            scheduler.shutdown()
+            return sent
+
+        self.assertEqual(run(test()), ["live", "backfill", "progress"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,10 @@ from starlette.middleware.cors import CORSMiddleware
 
 from common.config import config
 from common.database import Mongo
-from routes import api, vrc, views
+from common.index import image_index
+from common.utils import channel_cache
+from common.watchdog import Watchdog
+from routes import api, debug, metrics, vrc, views
 
 app = FastAPI(
     title="Discord2VRC",
@@ -18,19 +21,32 @@ app = FastAPI(
     ],
 )
 
+watchdog = Watchdog(config["web"]["lagthreshold"])
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(metrics.RecordMiddleware)
+app.add_middleware(debug.ProfileMiddleware)
 
+app.add_event_handler("startup", watchdog.start)
 app.add_event_handler("startup", Mongo.connect)
+app.add_event_handler("startup", image_index.start)
+app.add_event_handler("startup", channel_cache.start)
+app.add_event_handler("shutdown", channel_cache.stop)
+app.add_event_handler("shutdown", image_index.stop)
 app.add_event_handler("shutdown", Mongo.close)
+app.add_event_handler("shutdown", watchdog.stop)
 app.include_router(api.router, prefix="/api", tags=["api"])
 app.include_router(vrc.router, prefix="/vrc", tags=["vrc"])
 app.include_router(views.router)
+app.include_router(metrics.router)
+app.include_router(debug.router)
 app.mount(
     "/",
     StaticFiles(directory=config["directories"]["staticdir"]),